@@ -24,8 +24,12 @@ setup(
         "Programming Language :: Python :: 3.8"
     ],
 
-    package_dir={'': 'src'},
+    package_dir={'src': 'src'},
+    packages=['src'],
     python_requires='>=3.7, <4',
-    install_requires=['numpy', 'pandas', 'dask', 'distributed', 'arboreto']
+    install_requires=['numpy', 'pandas', 'dask', 'distributed', 'arboreto'],
+    entry_points={
+        'console_scripts': ['grn-batch=src.GRNcli:main'],
+    }
 
 )
\ No newline at end of file
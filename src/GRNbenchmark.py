@@ -0,0 +1,363 @@
+"""
+Offline benchmarks for the GRN refinement pipeline, including:
+- Synthetic scale-free GRN and TF-target library generators
+- Fixtures from bundled networks (data/networks) and libraries
+- Per-stage wall time and peak memory, saved as JSON
+- Cold import times of the package modules
+
+Usage (from the repository root):
+    python -m src.GRNbenchmark --sizes 10000 100000 --output bench.json
+    python -m src.GRNbenchmark --compare old.json new.json
+    python -m src.GRNbenchmark --sizes --no-bundled --import-budget 2
+"""
+
+import os
+import sys
+import json
+import time
+import glob
+import platform
+import argparse
+import subprocess
+import tracemalloc
+import pandas as pd
+import numpy as np
+
+import src.GRNrefinement as gr
+
+# modules timed by benchmarkImports; all but GRNinference are refinement-path
+IMPORT_MODULES = ("src.GRNrefinement", "src.GRNvalidation", "src.GRNconsensus",
+                  "src.GRNnetflux", "src.GRNcompact", "src.GRNinference")
+# inference dependencies that refinement-path imports should not load
+HEAVY_MODULES = ("distributed", "dask", "arboreto", "sklearn")
+
+
+# =========================
+# Synthetic data generators
+
+def makeSyntheticGRN(num_edges, num_tfs=None, num_genes=None,
+                     fanout_exponent=2.1, importance="lognormal", 
+                     path_density=0.0, input_density=0.0, num_mediators=None, seed=0):
+    """
+    Generates a GRN df ("TF", "target", "importance") with scale-free
+    TF fan-out, sorted by importance as grnboost2 output. Gene names
+    include the default refinement inputs/outputs, so refineGRN finds
+    paths on it.
+    :num_edges:         number of (unique) edges
+    :num_tfs:           number of TFs (default scales with num_genes)
+    :num_genes:         number of genes (default scales with num_edges)
+    :fanout_exponent:   power-law exponent of TF out-degree
+    :importance:        importance distribution: "lognormal",
+                        "exponential" or "pareto"
+    :path_density:      fraction of the input -> mediator TF and mediator
+                        TF -> output pairs added as edges (0: edges are all
+                        random, and refineGRN finds few paths)
+    :input_density:     fraction of the input -> input pairs added as edges;
+                        paths through chains of inputs grow steeply with it
+    :num_mediators:     number of mediator TFs (default 200)
+    """
+    rng = np.random.default_rng(seed)
+    if num_genes is None:
+        num_genes = max(2000, int(20*np.sqrt(num_edges)))
+    if num_tfs is None:
+        num_tfs = max(len(gr.INPUTS)+10, num_genes//15)
+    num_edges = min(num_edges, num_tfs*(num_genes-1))
+
+    tf_names = gr.INPUTS + ["TF"+str(i) for i in range(num_tfs-len(gr.INPUTS))]
+    genes = np.array(tf_names + gr.OUTPUTS +
+                     ["G"+str(i) for i in range(max(0, num_genes-num_tfs-len(gr.OUTPUTS)))],
+                     dtype=object)
+    # Zipf-like TF weights give a power-law out-degree distribution
+    weights = np.arange(1, num_tfs+1, dtype=np.float64) ** (-1/(fanout_exponent-1))
+    weights = weights[rng.permutation(num_tfs)] / weights.sum()
+
+    # input-output connectivity: input/mediator/output pairs
+    num_inputs = len(gr.INPUTS)
+    if num_mediators is None:
+        num_mediators = 200
+    num_mediators = min(num_mediators, num_tfs-num_inputs)
+    inputs = np.arange(num_inputs)
+    mediators = np.arange(num_inputs, num_inputs+num_mediators)
+    outputs = np.arange(num_tfs, num_tfs+len(gr.OUTPUTS))
+    keys = [np.add.outer(tfs.astype(np.int64)*len(genes), targets).ravel()
+            for tfs, targets in ((inputs, mediators), (mediators, outputs), (inputs, inputs))]
+    densities = np.repeat([path_density, path_density, input_density], [len(key) for key in keys])
+    keys = np.concatenate(keys)
+    keys = keys[(keys // len(genes) != keys % len(genes)) & (rng.random(len(keys)) < densities)]
+    keys = np.unique(keys)[:num_edges]
+    while len(keys) < num_edges:
+        draw = int((num_edges-len(keys))*1.2) + 16
+        tfs = rng.choice(num_tfs, size=draw, p=weights)
+        targets = rng.integers(0, len(genes), size=draw)
+        new_keys = tfs.astype(np.int64)*len(genes) + targets
+        keys = np.unique(np.concatenate([keys, new_keys[tfs != targets]]))
+    keys = rng.permutation(keys)[:num_edges]
+
+    if importance == "lognormal":
+        imps = rng.lognormal(-1, 1.2, num_edges)
+    elif importance == "exponential":
+        imps = rng.exponential(1, num_edges)
+    elif importance == "pareto":
+        imps = rng.pareto(1.5, num_edges)
+    else:
+        raise ValueError("Unknown importance distribution: "+str(importance))
+    grn = pd.DataFrame({"TF": genes[keys // len(genes)],
+                        "target": genes[keys % len(genes)],
+                        "importance": imps})
+    return grn.sort_values("importance", ascending=False).reset_index(drop=True)
+
+
+def makeSyntheticLibrary(grn, coverage=0.5, extra_edges=None, inout_coverage=None, seed=0):
+    """
+    Generates a TF-target library df in the Harmonizome layout used by
+    importLibraries ("source" = target gene, "target" = TF) containing
+    a fraction (coverage) of the GRN edges plus extra_edges random
+    TF-gene pairs (default: as many as the covered edges).
+    :inout_coverage:    (optional) fraction of the GRN edges from inputs
+                        or into outputs covered (default: coverage)
+    """
+    rng = np.random.default_rng(seed)
+    rates = np.full(len(grn), coverage, dtype=np.float64)
+    if inout_coverage is not None:
+        rates[(grn["TF"].isin(gr.INPUTS) | grn["target"].isin(gr.OUTPUTS)).to_numpy()] = inout_coverage
+    covered = grn.loc[rng.random(len(grn)) < rates, ["TF", "target"]]
+    if extra_edges is None:
+        extra_edges = len(covered)
+    tfs = grn["TF"].unique()
+    genes = pd.unique(pd.concat([grn["TF"], grn["target"]]))
+    library = pd.DataFrame({"source": np.concatenate([covered["target"].to_numpy(),
+                                                      rng.choice(genes, extra_edges)]),
+                            "target": np.concatenate([covered["TF"].to_numpy(),
+                                                      rng.choice(tfs, extra_edges)])})
+    return library.drop_duplicates().reset_index(drop=True)
+
+
+# =========================
+# Bundled fixtures
+
+def loadBundledNetworks(datadir="data/"):
+    """Returns the bundled refined networks (data/networks/GRN_CV_fold*.csv) as one GRN df"""
+    files = sorted(glob.glob(os.path.join(datadir, "networks", "GRN_CV_fold*.csv")))
+    grns = [pd.read_csv(file, index_col=0).loc[:, ["TF", "target", "importance"]]
+            for file in files]
+    return pd.concat(grns, axis=0).reset_index(drop=True)
+
+
+# =========================
+# Stage timing
+
+def timeStage(results, stage, function, *args, memory=True, **kwargs):
+    """
+    Runs function(*args, **kwargs) and appends a record of its wall
+    time, CPU time and (optionally) tracemalloc peak memory to results.
+    Returns the function's output.
+    """
+    if memory:
+        tracemalloc.start()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    output = function(*args, **kwargs)
+    record = {"stage": stage,
+              "wall_s": time.perf_counter() - wall,
+              "cpu_s": time.process_time() - cpu}
+    if memory:
+        record["peak_mb"] = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+    if isinstance(output, (pd.DataFrame, list)):
+        record["rows"] = len(output)
+    results.append(record)
+    return output
+
+
+def benchmarkRefinement(grn, library, rules=[1,0.75], memory=True):
+    """
+    Benchmarks the refinement stages on a GRN df and library df
+    (Harmonizome layout) and returns a list of stage records.
+    """
+    results = []
+    library_index = timeStage(results, "library_index", gr.buildLibraryIndex,
+                              library, memory=memory)
+    grn_targets = timeStage(results, "filterWithLibrary", gr.filterWithLibrary,
+                            grn, library_index, memory=memory)
+    input_keys = timeStage(results, "findInputs", gr.findInputsOrOutputs,
+                           grn_targets, gr.INPUTS, "TF", memory=memory)
+    output_keys = timeStage(results, "findOutputs", gr.findInputsOrOutputs,
+                            grn_targets, gr.OUTPUTS, "target", memory=memory)
+    grn_outputs = timeStage(results, "filterOutputs", gr.filterInputsOrOutputs,
+                            grn_targets, output_keys, "target", memory=memory)
+    grn_inputs = timeStage(results, "filterInputs", gr.filterInputsOrOutputs,
+                           grn_targets, input_keys, "TF", memory=memory)
+    paths_all_inout = timeStage(results, "filterInOutNetwork", gr.filterInOutNetwork,
+                                grn_inputs, grn_outputs, grn_targets, memory=memory)
+    adjacency = timeStage(results, "buildAdjacency", gr.buildAdjacency,
+                          paths_all_inout, memory=memory)
+    paths = timeStage(results, "findPathsBoth", gr.findPathsParallel, adjacency,
+                      input_keys, output_keys, rules=rules, memory=memory)
+    timeStage(results, "scorePaths", gr.scorePaths, paths_all_inout.reset_index(),
+              paths, adjacency=adjacency, memory=memory)
+    timeStage(results, "refineGRN", gr.refineGRN, grn, "synthetic",
+              library=library_index, memory=memory)
+    for record in results:
+        record["paths"] = len(paths)
+    return results
+
+
+# =========================
+# Import timing
+
+def benchmarkImports(modules=IMPORT_MODULES, repeat=3):
+    """
+    Times the cold import of each module in a fresh interpreter (the
+    median of repeat runs, including its dependencies such as pandas)
+    and lists the heavy inference dependencies (HEAVY_MODULES) it
+    loads. Returns a list of stage records.
+    """
+    code = ("import sys, time, json; wall = time.perf_counter(); import {module}; "
+            "wall = time.perf_counter() - wall; "
+            "print(json.dumps([wall, [name for name in {heavy} if name in sys.modules]]))")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    records = []
+    for module in modules:
+        times = []
+        for _ in range(repeat):
+            output = subprocess.run([sys.executable, "-c",
+                                     code.format(module=module, heavy=HEAVY_MODULES)],
+                                    cwd=root, capture_output=True, text=True, check=True)
+            wall, loaded = json.loads(output.stdout.strip().splitlines()[-1])
+            times.append(wall)
+        records.append({"stage": module, "fixture": "import", "edges": 0,
+                        "wall_s": float(np.median(times)), "heavy": loaded})
+    return records
+
+
+def checkImports(records, budget=None):
+    """
+    Given import records (benchmarkImports), returns messages for
+    refinement-path modules (all but GRNinference) that load heavy
+    inference dependencies or take longer than budget seconds.
+    """
+    problems = []
+    for record in records:
+        if record["stage"] == "src.GRNinference":
+            continue
+        if record["heavy"]:
+            problems.append(record["stage"]+" loads "+", ".join(record["heavy"]))
+        if budget is not None and record["wall_s"] > budget:
+            problems.append(record["stage"]+" imports in "+
+                            "{:.2f}".format(record["wall_s"])+" s (budget: "+str(budget)+" s)")
+    return problems
+
+
+def runBenchmarks(sizes=(10000, 100000, 1000000, 10000000), datadir="data/",
+                  bundled=True, seed=0, memory=True, importance="lognormal",
+                  imports=True, path_density=0.5, input_density=0.25):
+    """
+    Runs the refinement benchmarks on synthetic GRNs of the given
+    edge counts and (optionally) the bundled networks/libraries and
+    module import times. Returns a dict of run metadata and stage 
+    records (with the number of paths found per fixture).
+    :path_density, input_density:   input-output connectivity of the
+                    synthetic GRNs (see makeSyntheticGRN); the defaults
+                    give thousands to tens of thousands of paths
+    """
+    records = []
+    if imports:
+        records.extend(benchmarkImports())
+    for size in sizes:
+        grn = makeSyntheticGRN(int(size), importance=importance, path_density=path_density,
+                               input_density=input_density, seed=seed)
+        library = makeSyntheticLibrary(grn, inout_coverage=0.9, seed=seed)
+        for record in benchmarkRefinement(grn, library, memory=memory):
+            record.update({"fixture": "synthetic", "edges": len(grn)})
+            records.append(record)
+    if bundled:
+        grn = loadBundledNetworks(datadir)
+        library = gr.importLibraries(datadir, "CHEA", both=True)
+        for record in benchmarkRefinement(grn, library, memory=memory):
+            record.update({"fixture": "bundled_CHEA", "edges": len(grn)})
+            records.append(record)
+    meta = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "seed": seed,
+            "importance": importance,
+            "path_density": path_density,
+            "input_density": input_density}
+    return {"meta": meta, "results": records}
+
+
+def compareBenchmarks(old, new):
+    """
+    Given two benchmark result dicts (or JSON paths), returns a df of
+    wall time and peak memory per (fixture, edges, stage) with the
+    new/old ratios.
+    """
+    frames = []
+    for results in (old, new):
+        if isinstance(results, str):
+            with open(results) as infile:
+                results = json.load(infile)
+        frames.append(pd.DataFrame(results["results"]).set_index(["fixture", "edges", "stage"]))
+    compared = frames[0].join(frames[1], how="inner", lsuffix="_old", rsuffix="_new")
+    compared["wall_ratio"] = compared["wall_s_new"] / compared["wall_s_old"]
+    if "peak_mb_old" in compared and "peak_mb_new" in compared:
+        compared["peak_ratio"] = compared["peak_mb_new"] / compared["peak_mb_old"]
+    return compared
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark GRN refinement stages")
+    parser.add_argument("--sizes", type=float, nargs="*",
+                        default=[10000, 100000, 1000000, 10000000],
+                        help="synthetic GRN edge counts")
+    parser.add_argument("--datadir", default="data/",
+                        help="directory with networks/ and library folders")
+    parser.add_argument("--no-bundled", action="store_true",
+                        help="skip the bundled network fixture")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="skip tracemalloc peak memory tracking")
+    parser.add_argument("--no-imports", action="store_true",
+                        help="skip module import timing")
+    parser.add_argument("--import-budget", type=float, default=None,
+                        help="fail if a refinement-path module imports slower "
+                             "than this (seconds) or loads inference dependencies")
+    parser.add_argument("--importance", default="lognormal",
+                        help="synthetic importance distribution")
+    parser.add_argument("--path-density", type=float, default=0.5,
+                        help="synthetic input -> mediator -> output edge density")
+    parser.add_argument("--input-density", type=float, default=0.25,
+                        help="synthetic input -> input edge density")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="path of JSON results file")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), default=None,
+                        help="compare two JSON results files")
+    args = parser.parse_args(argv)
+
+    if args.compare is not None:
+        with pd.option_context("display.width", 200, "display.max_rows", None):
+            print(compareBenchmarks(*args.compare))
+        return
+    results = runBenchmarks(sizes=args.sizes, datadir=args.datadir,
+                            bundled=not args.no_bundled, seed=args.seed,
+                            memory=not args.no_memory, importance=args.importance,
+                            imports=not args.no_imports, path_density=args.path_density,
+                            input_density=args.input_density)
+    if args.output is not None:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=1)
+    json.dump(results["results"], sys.stdout, indent=1)
+    print()
+    if args.import_budget is not None and not args.no_imports:
+        problems = checkImports([record for record in results["results"]
+                                 if record["fixture"] == "import"],
+                                budget=args.import_budget)
+        for problem in problems:
+            print(problem)
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
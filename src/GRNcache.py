@@ -0,0 +1,226 @@
+"""
+Functions for caching parsed input files, including:
+- In-process LRU cache shared across calls (e.g. CV folds)
+- Compact on-disk columnar cache (category-coded NumPy arrays,
+  memory-mapped on load)
+- On-disk array sets (e.g. preprocessed expression matrices)
+Cache entries are keyed by source file path, mtime and size, so
+editing or deleting a source file invalidates its entries.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+import pandas as pd
+import numpy as np
+
+_memory_cache = OrderedDict()
+_memory_cache_size = 8
+# guards the LRU for callers refining in threads (e.g. GRNcli jobs)
+_memory_lock = threading.Lock()
+
+
+def sourceKey(sources, **params):
+    """
+    Given a list of source file paths and extra parameters,
+    returns a hashable key built from each file's absolute
+    path, mtime and size. Raises FileNotFoundError if a
+    source file no longer exists.
+    """
+    stats = []
+    for source in sources:
+        if source is None or not os.path.isfile(source):
+            raise FileNotFoundError("Source file not found: "+str(source))
+        stat = os.stat(source)
+        stats.append((os.path.abspath(source), stat.st_mtime_ns, stat.st_size))
+    return (tuple(stats), tuple(sorted(params.items())))
+
+
+def keyDigest(key):
+    """Returns a short hex digest of a cache key"""
+    return hashlib.sha1(repr(key).encode()).hexdigest()[:16]
+
+
+def memoryGet(key):
+    """Returns cached object for key (or None), marking it recently used"""
+    with _memory_lock:
+        if key in _memory_cache:
+            _memory_cache.move_to_end(key)
+            return _memory_cache[key]
+        return None
+
+
+def memoryPut(key, value):
+    """Stores object in the in-process LRU cache"""
+    with _memory_lock:
+        _memory_cache[key] = value
+        _memory_cache.move_to_end(key)
+        while len(_memory_cache) > _memory_cache_size:
+            _memory_cache.popitem(last=False)
+
+
+def clearMemoryCache():
+    """Empties the in-process LRU cache"""
+    with _memory_lock:
+        _memory_cache.clear()
+
+
+# =========================
+# On-disk columnar frames
+
+def saveFrame(frame, entrydir):
+    """
+    Writes a dataframe to a cache entry directory: string columns
+    as int32 codes plus categories, other columns and the index as
+    plain arrays (.npy). Written to a temporary directory first and
+    renamed, so partially written entries are never loaded.
+    """
+    tmpdir = entrydir+".tmp"+str(os.getpid())
+    if os.path.isdir(tmpdir):
+        shutil.rmtree(tmpdir)
+    os.makedirs(tmpdir)
+    columns = []
+    for num, name in enumerate(frame.columns):
+        values = frame[name]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            codes = values.cat.codes.to_numpy()
+            categories = values.cat.categories
+        elif values.dtype.kind in "biuf":
+            np.save(os.path.join(tmpdir, str(num)+".npy"), values.to_numpy())
+            columns.append([name, "array"])
+            continue
+        else:
+            codes, categories = pd.factorize(values)
+        np.save(os.path.join(tmpdir, str(num)+".codes.npy"), codes.astype(np.int32))
+        np.save(os.path.join(tmpdir, str(num)+".categories.npy"),
+                np.asarray(categories, dtype=str))
+        columns.append([name, "category"])
+    np.save(os.path.join(tmpdir, "index.npy"), frame.index.to_numpy())
+    with open(os.path.join(tmpdir, "columns.json"), "w") as output:
+        json.dump(columns, output)
+    if os.path.isdir(entrydir):
+        shutil.rmtree(entrydir)
+    os.rename(tmpdir, entrydir)
+
+
+def loadFrame(entrydir):
+    """
+    Loads a dataframe written by saveFrame, memory-mapping the
+    arrays; string columns are returned as categoricals.
+    """
+    with open(os.path.join(entrydir, "columns.json")) as infile:
+        columns = json.load(infile)
+    data = {}
+    for num, (name, kind) in enumerate(columns):
+        if kind == "category":
+            codes = np.load(os.path.join(entrydir, str(num)+".codes.npy"), mmap_mode="r")
+            categories = np.load(os.path.join(entrydir, str(num)+".categories.npy"), mmap_mode="r")
+            data[name] = pd.Categorical.from_codes(codes, categories=pd.Index(categories, dtype=object))
+        else:
+            data[name] = np.load(os.path.join(entrydir, str(num)+".npy"), mmap_mode="r")
+    index = np.load(os.path.join(entrydir, "index.npy"), mmap_mode="r")
+    return pd.DataFrame(data, index=index, columns=[name for name, _ in columns])
+
+
+def cacheDir(dirpath, cache_dir=None):
+    """
+    Resolves the on-disk cache directory for files under dirpath:
+    dirpath/.grncache by default (cache_dir None), cache_dir if
+    given, or None (in-process cache only) if cache_dir is False.
+    """
+    if cache_dir is False:
+        return None
+    if cache_dir is None:
+        return os.path.join(dirpath, ".grncache")
+    return cache_dir
+
+
+def pruneEntries(cache_dir, tag, keep=None):
+    """Removes on-disk entries for tag other than keep (stale versions)"""
+    if not os.path.isdir(cache_dir):
+        return
+    for entry in os.listdir(cache_dir):
+        if entry.startswith(tag+"-") and entry != keep:
+            shutil.rmtree(os.path.join(cache_dir, entry), ignore_errors=True)
+
+
+def loadCached(sources, loader, tag, cache_dir=None, **params):
+    """
+    Returns the dataframe produced by loader() for the given source
+    files, cached in the in-process LRU and (optionally) on disk.
+    Each call returns a copy, so callers may modify it without
+    affecting the cached frame; string columns of frames cached on
+    disk are categoricals (see loadFrame).
+    :sources:   list of source file paths the result depends on
+    :loader:    function returning the parsed dataframe
+    :tag:       name of the cache entry (e.g. library name + options)
+    :cache_dir: (optional) directory for the on-disk cache; if None,
+                only the in-process cache is used
+    :params:    additional parameters included in the cache key
+    """
+    try:
+        key = (tag, sourceKey(sources, **params))
+    except FileNotFoundError:
+        if cache_dir is not None:
+            pruneEntries(cache_dir, tag)
+        raise
+    frame = memoryGet(key)
+    if frame is not None:
+        return frame.copy()
+
+    if cache_dir is None:
+        frame = loader()
+    else:
+        entry = tag+"-"+keyDigest(key)
+        entrydir = os.path.join(cache_dir, entry)
+        if os.path.isfile(os.path.join(entrydir, "columns.json")):
+            frame = loadFrame(entrydir)
+        else:
+            frame = loader()
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                pruneEntries(cache_dir, tag, keep=entry)
+                saveFrame(frame, entrydir)
+                frame = loadFrame(entrydir)
+            except OSError:
+                # read-only location: keep the parsed frame in memory only
+                pass
+    memoryPut(key, frame)
+    return frame.copy()
+
+
+# =========================
+# On-disk array sets
+
+def fileHash(filepath, blocksize=1<<20):
+    """Returns the SHA-256 hex digest of a file's contents"""
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as infile:
+        for block in iter(lambda: infile.read(blocksize), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def saveArrays(arrays, entrydir):
+    """
+    Writes a dict of NumPy arrays to a cache entry directory (one
+    .npy per array), via a temporary directory and rename.
+    """
+    tmpdir = entrydir+".tmp"+str(os.getpid())
+    if os.path.isdir(tmpdir):
+        shutil.rmtree(tmpdir)
+    os.makedirs(tmpdir)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmpdir, name+".npy"), array)
+    if os.path.isdir(entrydir):
+        shutil.rmtree(entrydir)
+    os.rename(tmpdir, entrydir)
+
+
+def loadArrays(entrydir, names):
+    """Loads named arrays written by saveArrays as memory maps"""
+    return {name: np.load(os.path.join(entrydir, name+".npy"), mmap_mode="r")
+            for name in names}
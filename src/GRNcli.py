@@ -0,0 +1,340 @@
+"""
+Command-line batch runner for GRN inference, including:
+- JSON job manifests (datasets x libraries x seeds x k)
+- Local process pool or shared Dask cluster execution with a
+  limit on concurrent jobs
+- Skipping of jobs whose outputs exist and a JSON run summary
+
+Usage (from the repository root, or as grn-batch once installed):
+    python -m src.GRNcli manifest.json --max-jobs 2
+    python -m src.GRNcli manifest.json --scheduler tcp://host:8786 --max-jobs 4
+
+Manifest:
+    {"libpath": "data/", "savedir": "runs/",
+     "datasets": ["data/expression/CPM.csv"],
+     "libraries": ["CHEA", "TRANSFACpredicted"],
+     "seeds": [0, 1],
+     "k": [null, 5],
+     "options": {"cache_dir": "cache/"},
+     "single_options": {"library_aware": true},
+     "cv_options": {"pipeline": true, "fold_seed": 0}}
+k = null (or 0) runs single inference (inferGRN), otherwise k-fold
+cross validation (crossvalidateGRN). "options" are passed to each job
+whose function accepts them; "single_options" and "cv_options" only
+to inferGRN or crossvalidateGRN jobs, respectively. A "jobs" list of
+dicts (filename, libname, seed, k, name, options) adds jobs outside
+the grid. Unknown options raise a ValueError when the manifest is
+expanded. Each job writes to savedir/<job name>/; paths are relative
+to the working directory.
+"""
+
+import os
+import sys
+import json
+import time
+import inspect
+import argparse
+import itertools
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import src.GRNinference as gi
+
+
+# =========================
+# Manifest functions
+
+def loadManifest(filepath):
+    """Reads a JSON job manifest"""
+    with open(filepath) as infile:
+        return json.load(infile)
+
+
+def datasetName(filename):
+    """Returns the name of a dataset file without directories and extensions"""
+    name = os.path.basename(filename)
+    for extension in (".gz", ".csv"):
+        if name.endswith(extension):
+            name = name[:-len(extension)]
+    return name
+
+
+def jobName(job):
+    """Returns the default name of a job: <dataset>_<library>_seed<seed>_<k>"""
+    seed = "none" if job.get("seed") is None else str(job["seed"])
+    mode = "k"+str(job["k"]) if job.get("k") else "single"
+    return "_".join([datasetName(job["filename"]), job["libname"], "seed"+seed, mode])
+
+
+# arguments set by the runner for every job
+JOB_ARGUMENTS = ("filename", "libpath", "libname", "k", "lib_both", "savedir", 
+                 "seed", "client")
+
+
+def jobFunction(job):
+    """Returns the inference function run by a job"""
+    return gi.crossvalidateGRN if job.get("k") else gi.inferGRN
+
+
+def functionOptions(function):
+    """Returns the keyword options of an inference function a manifest may set"""
+    return [name for name in inspect.signature(function).parameters
+            if name not in JOB_ARGUMENTS]
+
+
+def _checkOptions(options, allowed, where):
+    """Raises a ValueError naming the options not in allowed"""
+    unknown = [key for key in options if key not in allowed]
+    if unknown:
+        raise ValueError("Unknown options in "+where+": "+", ".join(unknown)+
+                         " (allowed: "+", ".join(allowed)+")")
+
+
+def jobOptions(manifest, job, options=None):
+    """
+    Returns the options of a job: the manifest's shared "options" that
+    its function accepts, then its mode's "single_options"/"cv_options",
+    then the job's own options (which its function must accept).
+    """
+    allowed = functionOptions(jobFunction(job))
+    mode_key = "cv_options" if job.get("k") else "single_options"
+    _checkOptions(options or {}, allowed, "job "+job["name"])
+    shared = {key: value for key, value in manifest.get("options", {}).items()
+              if key in allowed}
+    return {**shared, **manifest.get(mode_key, {}), **(options or {})}
+
+
+def expandManifest(manifest):
+    """
+    Expands a manifest into a list of job dicts ("name", "filename",
+    "libpath", "libname", "lib_both", "seed", "k", "savedir" and
+    "options"), in grid order followed by any explicit jobs. Raises
+    a ValueError for options no inference function accepts.
+    """
+    libpath = manifest.get("libpath", "data/")
+    savedir = manifest.get("savedir", "runs/")
+    single_allowed = functionOptions(gi.inferGRN)
+    cv_allowed = functionOptions(gi.crossvalidateGRN)
+    _checkOptions(manifest.get("options", {}), 
+                  list(dict.fromkeys(single_allowed+cv_allowed)), "options")
+    _checkOptions(manifest.get("single_options", {}), single_allowed, "single_options")
+    _checkOptions(manifest.get("cv_options", {}), cv_allowed, "cv_options")
+    grid = itertools.product(manifest.get("datasets", []),
+                             manifest.get("libraries", []),
+                             manifest.get("seeds", [None]),
+                             manifest.get("k", [None]))
+    specs = [{"filename": filename, "libname": libname, "seed": seed, "k": k}
+             for filename, libname, seed, k in grid]
+    specs = specs + manifest.get("jobs", [])
+
+    jobs = []
+    for spec in specs:
+        job = {"libpath": libpath, "lib_both": manifest.get("lib_both", True),
+               "seed": None, "k": None, **spec}
+        job["name"] = spec.get("name", jobName(job))
+        job["savedir"] = os.path.join(savedir, job["name"], "")
+        job["options"] = jobOptions(manifest, job, spec.get("options"))
+        jobs.append(job)
+    names = [job["name"] for job in jobs]
+    if len(set(names)) < len(names):
+        raise ValueError("Duplicate job names in manifest")
+    return jobs
+
+
+def jobOutputs(job):
+    """Returns the GRN CSV paths written by a job (named as saveGRN)"""
+    suffix = job["options"].get("suffix")
+    ext_csv = ".csv" if suffix is None else "_"+suffix+".csv"
+    if job.get("k"):
+        return [job["savedir"]+"GRN_CV_fold"+str(fold)+ext_csv for fold in range(job["k"])]
+    return [job["savedir"]+"GRN_single"+ext_csv]
+
+
+def jobComplete(job):
+    """Returns whether all of a job's outputs exist"""
+    return all(os.path.isfile(path) for path in jobOutputs(job))
+
+
+# =========================
+# Execution functions
+
+def runJob(job, client=None, cluster_options=None):
+    """
+    Runs one job (inferGRN, or crossvalidateGRN if k is set) and
+    returns its summary record (status "done" or "failed", wall
+    time, refined edge count, outputs and any error).
+    :client:            (optional) Dask client shared by jobs; it is
+                        not shut down
+    :cluster_options:   (optional) dict of LocalCluster arguments for a
+                        per-job cluster (e.g. n_workers, threads_per_worker)
+    """
+    record = {"name": job["name"], "status": "done", "outputs": jobOutputs(job)}
+    wall = time.perf_counter()
+    owns_client = client is None
+    try:
+        if owns_client:
+            gi.configureEventLoop()
+            from distributed import Client, LocalCluster
+            client = Client(LocalCluster(dashboard_address=":0", **(cluster_options or {})))
+        os.makedirs(job["savedir"], exist_ok=True)
+        if job.get("k"):
+            grn = gi.crossvalidateGRN(job["filename"], job["libpath"], job["libname"],
+                                      job["k"], lib_both=job["lib_both"],
+                                      savedir=job["savedir"], seed=job["seed"],
+                                      client=client, **job["options"])
+        else:
+            grn = gi.inferGRN(job["filename"], job["libpath"], job["libname"],
+                              lib_both=job["lib_both"], savedir=job["savedir"],
+                              seed=job["seed"], client=client, **job["options"])
+        record["edges"] = len(grn)
+    except Exception as error:
+        record["status"] = "failed"
+        record["error"] = repr(error)
+        record["traceback"] = traceback.format_exc()
+    finally:
+        if owns_client and client is not None:
+            client.close()
+            client.cluster.close()
+    record["wall_s"] = time.perf_counter() - wall
+    record["finished"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    return record
+
+
+def writeSummary(summary, filepath):
+    """Writes a run summary as JSON (via a temporary file)"""
+    tmpfile = filepath+".tmp"
+    with open(tmpfile, "w") as output:
+        json.dump(summary, output, indent=1, default=str)
+    os.replace(tmpfile, filepath)
+
+
+def readSummary(filepath):
+    """Returns the job records of an earlier run summary by name (or {})"""
+    try:
+        with open(filepath) as infile:
+            summary = json.load(infile)
+    except (OSError, ValueError):
+        return {}
+    return {record["name"]: record for record in summary.get("jobs", [])}
+
+
+def runManifest(manifest, max_jobs=1, scheduler=None, cluster_options=None,
+                force=False, summary_path=None):
+    """
+    Runs the jobs of a manifest and returns the run summary.
+    :max_jobs:          maximum number of jobs running at once
+    :scheduler:         (optional) address of a shared Dask scheduler;
+                        jobs then run in threads of this process, sharing
+                        one client. By default each job runs in its own
+                        process (or in this process if max_jobs is 1)
+                        with its own LocalCluster
+    :cluster_options:   (optional) dict of per-job LocalCluster arguments
+    :force:             Boolean determining whether jobs with existing
+                        outputs are rerun (CV jobs then also recompute folds
+                        saved by an earlier run, see crossvalidateGRN resume)
+    :summary_path:      (optional) path of the JSON run summary, rewritten
+                        as each job finishes (default: savedir/run_summary.json);
+                        skipped jobs keep their record from an earlier summary
+                        (wall time, edge count, finish time)
+    """
+    jobs = expandManifest(manifest)
+    if summary_path is None:
+        savedir = manifest.get("savedir", "runs/")
+        os.makedirs(savedir, exist_ok=True)
+        summary_path = os.path.join(savedir, "run_summary.json")
+    previous = readSummary(summary_path)
+    records = {}
+    pending = []
+    for job in jobs:
+        if not force and jobComplete(job):
+            records[job["name"]] = {**previous.get(job["name"], {}), "name": job["name"], 
+                                    "status": "skipped", "outputs": jobOutputs(job)}
+        else:
+            if force and job.get("k"):
+                # recompute folds saved by an earlier run of the job
+                job = {**job, "options": {"resume": False, **job["options"]}}
+            pending.append(job)
+
+    summary = {"started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "max_jobs": max_jobs, "scheduler": scheduler}
+    wall = time.perf_counter()
+
+    def update(record):
+        records[record["name"]] = record
+        print(record["name"]+": "+record["status"]+
+              (" ({:.1f} s)".format(record["wall_s"]) if record["status"] != "skipped" else ""))
+        summary["jobs"] = [records[job["name"]] for job in jobs if job["name"] in records]
+        summary["wall_s"] = time.perf_counter() - wall
+        writeSummary(summary, summary_path)
+
+    for job in jobs:
+        if job["name"] in records:
+            update(records[job["name"]])
+    if scheduler is not None:
+        gi.configureEventLoop()
+        from distributed import Client
+        client = Client(scheduler)
+        try:
+            with ThreadPoolExecutor(max_workers=max_jobs) as pool:
+                futures = [pool.submit(runJob, job, client=client) for job in pending]
+                for future in as_completed(futures):
+                    update(future.result())
+        finally:
+            client.close()
+    elif max_jobs == 1:
+        for job in pending:
+            update(runJob(job, cluster_options=cluster_options))
+    else:
+        with ProcessPoolExecutor(max_workers=max_jobs) as pool:
+            futures = [pool.submit(runJob, job, cluster_options=cluster_options)
+                       for job in pending]
+            for future in as_completed(futures):
+                update(future.result())
+
+    statuses = [records[job["name"]]["status"] for job in jobs]
+    summary["finished"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    summary["counts"] = {status: statuses.count(status)
+                         for status in ("done", "skipped", "failed")}
+    summary["jobs"] = [records[job["name"]] for job in jobs]
+    summary["wall_s"] = time.perf_counter() - wall
+    writeSummary(summary, summary_path)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a manifest of GRN inference jobs")
+    parser.add_argument("manifest", help="path of the JSON job manifest")
+    parser.add_argument("--max-jobs", type=int, default=1,
+                        help="maximum number of jobs running at once")
+    parser.add_argument("--scheduler", default=None,
+                        help="address of a shared Dask scheduler (default: one "
+                             "LocalCluster per job)")
+    parser.add_argument("--n-workers", type=int, default=None,
+                        help="Dask workers per job's LocalCluster")
+    parser.add_argument("--threads-per-worker", type=int, default=None,
+                        help="threads per Dask worker of each job's LocalCluster")
+    parser.add_argument("--force", action="store_true",
+                        help="rerun jobs whose outputs exist")
+    parser.add_argument("--summary", default=None,
+                        help="path of the JSON run summary (default: "
+                             "<savedir>/run_summary.json)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="list jobs and whether they would run")
+    args = parser.parse_args(argv)
+
+    manifest = loadManifest(args.manifest)
+    if args.dry_run:
+        for job in expandManifest(manifest):
+            print(job["name"]+": "+("skip" if not args.force and jobComplete(job) else "run"))
+        return 0
+    cluster_options = {key: value for key, value in (("n_workers", args.n_workers),
+                       ("threads_per_worker", args.threads_per_worker)) if value is not None}
+    summary = runManifest(manifest, max_jobs=args.max_jobs, scheduler=args.scheduler,
+                          cluster_options=cluster_options, force=args.force,
+                          summary_path=args.summary)
+    print(", ".join(status+": "+str(count) for status, count in summary["counts"].items()))
+    return 1 if summary["counts"]["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+"""
+Compact GRN representation for the refinement API, including:
+- CompactGRN container: shared gene vocabulary, int32 TF/target
+  codes, float32 importance and row labels (plus the original labels
+  after resetIndex)
+- Conversion to/from the TF-target-importance dataframe schema
+- Edge view with __slots__ for row-wise access
+Row selections only take the selected code/importance entries; gene
+names are never copied or compared as strings.
+"""
+
+import pandas as pd
+import numpy as np
+
+
+class CompactGRN:
+    """
+    Integer-coded GRN. TF/target genes are int32 codes into a gene
+    vocabulary (pd.Index) that can be shared by many networks.
+    :genes:         gene vocabulary (pd.Index of names)
+    :tf, target:    int32 arrays of gene codes
+    :importance:    float32 (or float64) array of edge importances
+    :index:         array of row labels (e.g. the inferred GRN's index)
+    :labels:        (optional) array of earlier row labels moved out of
+                    the index by resetIndex (the df "index" column)
+    """
+    __slots__ = ("genes", "tf", "target", "importance", "index", "labels")
+
+    def __init__(self, genes, tf, target, importance, index=None, labels=None):
+        self.genes = genes
+        self.tf = tf
+        self.target = target
+        self.importance = importance
+        self.index = np.arange(len(tf), dtype=np.int64) if index is None else index
+        self.labels = labels
+
+    @classmethod
+    def fromFrame(cls, grn, genes=None, dtype=np.float32):
+        """
+        Converts a GRN df ("TF", "target", "importance") to a CompactGRN.
+        Genes are coded against genes (a shared vocabulary, extended
+        with any new genes) or a new vocabulary in order of appearance.
+        :dtype:     importance dtype (float64 keeps values exact)
+        """
+        tf_values = grn["TF"].to_numpy(dtype=object)
+        target_values = grn["target"].to_numpy(dtype=object)
+        values = np.concatenate([tf_values, target_values])
+        if genes is None:
+            codes, genes = pd.factorize(values)
+            genes = pd.Index(genes, dtype=object)
+        else:
+            codes = genes.get_indexer(values)
+            if (codes < 0).any():
+                genes = genes.append(pd.Index(pd.unique(values[codes < 0]), dtype=object))
+                codes = genes.get_indexer(values)
+        index = grn.index.to_numpy()
+        if index.dtype.kind in "iu" and (len(index) == 0 or
+                                         (index.min() >= 0 and index.max() < 2**31)):
+            index = index.astype(np.int32)
+        return cls(genes,
+                   codes[:len(tf_values)].astype(np.int32),
+                   codes[len(tf_values):].astype(np.int32),
+                   grn["importance"].to_numpy(dtype=dtype),
+                   index)
+
+    def toFrame(self):
+        """
+        Returns the GRN as a TF-target-importance df (index: row
+        labels). After resetIndex, the earlier labels are the first
+        ("index") column, as for DataFrame.reset_index.
+        """
+        genes = self.genes.to_numpy(dtype=object)
+        columns = {}
+        if self.labels is not None:
+            labels = self.labels
+            columns["index"] = labels.astype(np.int64) if labels.dtype.kind in "iu" else labels
+        columns["TF"] = genes[self.tf]
+        columns["target"] = genes[self.target]
+        columns["importance"] = self.importance.astype(np.float64)
+        return pd.DataFrame(columns, index=pd.Index(self.index.astype(np.int64) 
+                                                    if self.index.dtype.kind in "iu" 
+                                                    else self.index))
+
+    def resetIndex(self):
+        """
+        Returns the GRN with row positions as its index and the 
+        current row labels kept as labels (as DataFrame.reset_index)
+        """
+        return CompactGRN(self.genes, self.tf, self.target, self.importance, 
+                          labels=self.index)
+
+    def __len__(self):
+        return len(self.tf)
+
+    def __repr__(self):
+        return ("CompactGRN("+str(len(self))+" edges, "+str(len(self.genes))+
+                " genes, "+str(self.nbytes())+" bytes)")
+
+    def nbytes(self):
+        """Returns the memory used by the edge arrays (excluding the vocabulary)"""
+        return (self.tf.nbytes + self.target.nbytes + self.importance.nbytes + 
+                self.index.nbytes + (0 if self.labels is None else self.labels.nbytes))
+
+    def take(self, rows):
+        """Returns the GRN restricted to row positions (or a boolean mask)"""
+        if isinstance(rows, np.ndarray) and rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+        return CompactGRN(self.genes, self.tf[rows], self.target[rows],
+                          self.importance[rows], self.index[rows],
+                          None if self.labels is None else self.labels[rows])
+
+    def codesOf(self, values):
+        """Returns vocabulary codes of gene names (-1 if absent)"""
+        return self.genes.get_indexer(list(values))
+
+    def column(self, column):
+        """Returns the codes of the "TF" or "target" column"""
+        if column == "TF":
+            return self.tf
+        if column == "target":
+            return self.target
+        raise KeyError(column)
+
+    @staticmethod
+    def concat(grns):
+        """Concatenates GRNs sharing one gene vocabulary"""
+        genes = grns[0].genes
+        for grn in grns[1:]:
+            if grn.genes is not genes and not grn.genes.equals(genes):
+                raise ValueError("CompactGRNs must share a gene vocabulary")
+        labels = None
+        if all(grn.labels is not None for grn in grns):
+            labels = np.concatenate([grn.labels for grn in grns])
+        return CompactGRN(genes,
+                          np.concatenate([grn.tf for grn in grns]),
+                          np.concatenate([grn.target for grn in grns]),
+                          np.concatenate([grn.importance for grn in grns]),
+                          np.concatenate([grn.index for grn in grns]),
+                          labels)
+
+    def edge(self, row):
+        """Returns a view of the edge at a row position"""
+        return Edge(self, row)
+
+    def edges(self):
+        """Iterates over views of all edges"""
+        for row in range(len(self)):
+            yield Edge(self, row)
+
+
+class Edge:
+    """Lightweight view of one edge of a CompactGRN"""
+    __slots__ = ("grn", "row")
+
+    def __init__(self, grn, row):
+        self.grn = grn
+        self.row = row
+
+    @property
+    def TF(self):
+        return self.grn.genes[self.grn.tf[self.row]]
+
+    @property
+    def target(self):
+        return self.grn.genes[self.grn.target[self.row]]
+
+    @property
+    def importance(self):
+        return float(self.grn.importance[self.row])
+
+    @property
+    def label(self):
+        return self.grn.index[self.row]
+
+    def __repr__(self):
+        return "Edge("+str(self.TF)+" -> "+str(self.target)+", "+str(self.importance)+")"
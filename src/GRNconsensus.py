@@ -0,0 +1,163 @@
+"""
+Functions for building consensus networks from many GRNs (CV folds,
+repeated CV, seed sweeps), including:
+- Incremental edge accumulator over a shared integer-coded edge index
+- Vectorized edge frequency, importance and rank statistics
+- Loading from fold CSVs, the fold store or stacked CV output
+Memory scales with the number of unique edges, not networks x edges.
+"""
+
+import glob
+import pandas as pd
+import numpy as np
+
+import src.GRNstore as gs
+
+
+def newAccumulator():
+    """
+    Returns an empty edge accumulator: a gene vocabulary, sorted
+    int64 edge keys (TF code << 32 | target code) and per-edge
+    running statistics (count, mean and sum of squared deviations
+    of importance and of normalized rank).
+    """
+    return {"genes": [],
+            "vocab": pd.Index([], dtype=object),
+            "keys": np.array([], dtype=np.int64),
+            "count": np.array([], dtype=np.int64),
+            "imp_mean": np.array([], dtype=np.float64),
+            "imp_m2": np.array([], dtype=np.float64),
+            "rank_mean": np.array([], dtype=np.float64),
+            "rank_m2": np.array([], dtype=np.float64),
+            "num_networks": 0}
+
+
+def _encodeGenes(accumulator, values):
+    """Returns int64 codes of gene names, adding new genes to the vocabulary"""
+    codes = accumulator["vocab"].get_indexer(values)
+    if (codes < 0).any():
+        new_genes = pd.unique(np.asarray(values, dtype=object)[codes < 0])
+        accumulator["genes"].extend(new_genes.tolist())
+        accumulator["vocab"] = pd.Index(accumulator["genes"], dtype=object)
+        codes = accumulator["vocab"].get_indexer(values)
+    return codes.astype(np.int64)
+
+
+def _expandStats(accumulator, keys):
+    """Inserts new edge keys (sorted, unique) into the accumulator arrays"""
+    new_keys = np.setdiff1d(keys, accumulator["keys"], assume_unique=True)
+    if len(new_keys) == 0:
+        return
+    merged = np.union1d(accumulator["keys"], new_keys)
+    old_positions = np.searchsorted(merged, accumulator["keys"])
+    for name in ("count", "imp_mean", "imp_m2", "rank_mean", "rank_m2"):
+        expanded = np.zeros(len(merged), dtype=accumulator[name].dtype)
+        expanded[old_positions] = accumulator[name]
+        accumulator[name] = expanded
+    accumulator["keys"] = merged
+
+
+def addNetwork(accumulator, grn):
+    """
+    Adds one GRN df ("TF", "target", "importance") to the accumulator.
+    Duplicate edges within the GRN keep their highest importance.
+    Ranks are by importance within the GRN (1 = most important),
+    normalized by the number of edges.
+    """
+    grn = grn.sort_values("importance", ascending=False, kind="stable")
+    tf_codes = _encodeGenes(accumulator, grn["TF"].to_numpy(dtype=object))
+    target_codes = _encodeGenes(accumulator, grn["target"].to_numpy(dtype=object))
+    keys = (tf_codes << 32) | target_codes
+    keys, first = np.unique(keys, return_index=True)
+    imps = grn["importance"].to_numpy(dtype=np.float64)[first]
+    # rank among unique edges (first = position in importance order)
+    ranks = (np.argsort(np.argsort(first, kind="stable")) + 1) / max(len(first), 1)
+
+    _expandStats(accumulator, keys)
+    positions = np.searchsorted(accumulator["keys"], keys)
+    # Welford update (each edge is seen at most once per network)
+    count = accumulator["count"][positions] + 1
+    accumulator["count"][positions] = count
+    for name, values in (("imp", imps), ("rank", ranks)):
+        mean = accumulator[name+"_mean"][positions]
+        delta = values - mean
+        mean = mean + delta / count
+        accumulator[name+"_mean"][positions] = mean
+        accumulator[name+"_m2"][positions] += delta * (values - mean)
+    accumulator["num_networks"] += 1
+    return accumulator
+
+
+def addNetworks(accumulator, grns):
+    """Adds an iterable of GRN dfs to the accumulator (one at a time)"""
+    for grn in grns:
+        addNetwork(accumulator, grn)
+    return accumulator
+
+
+def consensusNetwork(accumulator, min_frequency=0, min_count=1):
+    """
+    Returns the consensus network of the accumulated GRNs as a df
+    of edges ("TF", "target") with their count, frequency (fraction
+    of networks containing the edge), mean/sd importance and mean/sd
+    normalized rank (sample sd; NaN for edges seen once), filtered
+    by frequency/count and sorted by frequency and mean importance.
+    """
+    num_networks = max(accumulator["num_networks"], 1)
+    count = accumulator["count"]
+    frequency = count / num_networks
+    keep = np.flatnonzero((frequency >= min_frequency) & (count >= min_count))
+    keys = accumulator["keys"][keep]
+    genes = np.asarray(accumulator["genes"], dtype=object)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        imp_sd = np.sqrt(accumulator["imp_m2"][keep] / (count[keep] - 1))
+        rank_sd = np.sqrt(accumulator["rank_m2"][keep] / (count[keep] - 1))
+    consensus = pd.DataFrame({"TF": genes[keys >> 32],
+                              "target": genes[keys & 0xFFFFFFFF],
+                              "count": count[keep],
+                              "frequency": frequency[keep],
+                              "importance_mean": accumulator["imp_mean"][keep],
+                              "importance_sd": imp_sd,
+                              "rank_mean": accumulator["rank_mean"][keep],
+                              "rank_sd": rank_sd})
+    consensus = consensus.sort_values(["frequency", "importance_mean"],
+                                      ascending=False, kind="stable")
+    return consensus.reset_index(drop=True)
+
+
+# =========================
+# Loading functions
+
+def readNetwork(filepath):
+    """Reads a saved GRN CSV (as saveGRN) as a TF-target-importance df"""
+    return pd.read_csv(filepath, index_col=0).loc[:, ["TF", "target", "importance"]]
+
+
+def consensusFromFiles(filepaths, min_frequency=0, min_count=1):
+    """
+    Given a list of GRN CSV paths or a glob pattern (e.g.
+    "data/networks/GRN_CV_fold*.csv"), returns their consensus
+    network, reading one file at a time.
+    """
+    if isinstance(filepaths, str):
+        filepaths = sorted(glob.glob(filepaths))
+    accumulator = addNetworks(newAccumulator(),
+                              (readNetwork(filepath) for filepath in filepaths))
+    return consensusNetwork(accumulator, min_frequency=min_frequency, min_count=min_count)
+
+
+def consensusFromStore(storedir, min_frequency=0, min_count=1):
+    """Returns the consensus network of all folds in a fold store (GRNstore)"""
+    accumulator = addNetworks(newAccumulator(),
+                              (grn for _, grn, _, _ in gs.iterFolds(storedir)))
+    return consensusNetwork(accumulator, min_frequency=min_frequency, min_count=min_count)
+
+
+def consensusFromFolds(grn_all, min_frequency=0, min_count=1, column="fold"):
+    """
+    Returns the consensus network of stacked GRNs (e.g. crossvalidateGRN
+    output), one network per value of column.
+    """
+    accumulator = addNetworks(newAccumulator(),
+                              (grn for _, grn in grn_all.groupby(column, sort=True)))
+    return consensusNetwork(accumulator, min_frequency=min_frequency, min_count=min_count)
@@ -2,22 +2,27 @@
 Scripts for inferring GRNs, including:
 - Single inference
 - k-fold cross validation
+- Ensemble (seed sweep / bootstrap) inference
 - Conversion to Netflux models
+Dask (distributed) and arboreto are imported when inference runs, so
+importing this module for its data loading helpers stays fast.
 """
 
 import os
-# import time
+import sys
+import time
 import pandas as pd
 import numpy as np
-import asyncio
 
-from distributed import Client, LocalCluster
-from arboreto.algo import grnboost2
-
-from src.GRNrefinement import refineGRN
+from src.GRNrefinement import (refineGRN, importLibraryIndex, filterWithLibrary,
+                               INPUTS, OUTPUTS, OUTPUT_REGEX, OUTPUT_REGEX_OTHERS)
+from src.GRNcompact import CompactGRN
 import src.GRNvalidation as gv
-
-asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+import src.GRNcache as gc
+import src.GRNstore as gs
+import src.GRNprofile as gp
+import src.GRNnetflux as gn
+import src.GRNconsensus as gcons
 
 
 
@@ -27,23 +32,41 @@ def importData(filepath):
     return data
 
 
-def importTFs(dirpath, libraryname, both=True):
+def readTFs(libfiles):
+    """
+    Parses Harmonizome attribute list files and returns the 
+    combined list of TFs (duplicates removed).
+    """
+    tf_all = None
+    for libfile in libfiles:
+        tf_file = pd.read_table(libfile)
+        if tf_all is None:
+            tf_all = tf_file
+        else:
+            tf_all = pd.concat([tf_all, tf_file], axis=0).drop_duplicates()
+    return tf_all
+
+
+def importTFs(dirpath, libraryname, both=True, cache=True, cache_dir=None):
     """
     Imports list of TFs from specified top-level directory
     (dirpath) and library string (libraryname). Optionally
     adds a second library to create composite list for 
-    wider coverage of TFs.
+    wider coverage of TFs. Parsed lists are cached as in
+    importLibraries (cache, cache_dir; see GRNcache): each 
+    call returns a copy, with a categorical column if cached.
     """
     from src.GRNrefinement import getLibPath
     libextension = "_attribute_list_entries.txt.gz"
-    libfile = getLibPath(dirpath, libraryname, filter_extension=libextension)
-    tf_all = pd.read_table(libfile)
+    libfiles = [getLibPath(dirpath, libraryname, filter_extension=libextension)]
     if both:
         libname = "TRANSFACpredicted"
-        libfile = getLibPath(dirpath, libname, filter_extension=libextension)
-        tf_2 = pd.read_table(libfile)
-        tf_all = pd.concat([tf_all, tf_2], axis=0).drop_duplicates()
-    return tf_all
+        libfiles.append(getLibPath(dirpath, libname, filter_extension=libextension))
+    if not cache:
+        return readTFs(libfiles)
+    tag = "tfs_"+libraryname+("_both" if both else "")
+    return gc.loadCached(libfiles, lambda: readTFs(libfiles), tag,
+                         cache_dir=gc.cacheDir(dirpath, cache_dir))
 
 
 def processData(data, cutoff=1, num_samples=2):
@@ -61,6 +84,137 @@ def processData(data, cutoff=1, num_samples=2):
     return data_array, data_genes
 
 
+def importDataChunked(filepath, cutoff=1, num_samples=2, samples=None,
+                      chunksize=5000, dtype=np.float32, memmap_path=None):
+    """
+    Out-of-core version of importData + processData. Streams gene 
+    rows of a CPM CSV in chunks, applies the EdgeR threshold (CPM >= 
+    cutoff in >= num_samples samples) per chunk and returns a samples 
+    x genes array (dtype, float32 by default), the kept gene names and 
+    the sample names.
+    :samples:       (optional) list of sample names (columns) to load
+    :chunksize:     number of gene rows parsed at a time
+    :memmap_path:   (optional) path of a .npy file backing the returned
+                    array as a read-only memory map
+    Note: the threshold is applied to the parsed float64 values, so the 
+    kept genes match processData.
+    """
+    header = pd.read_csv(filepath, index_col=0, header=1, nrows=0)
+    if samples is None:
+        samples = header.columns.tolist()
+    usecols = [0] + [header.columns.get_loc(sample)+1 for sample in samples]
+    reader = pd.read_csv(filepath, index_col=0, header=1, chunksize=chunksize,
+                         usecols=usecols, dtype={sample: np.float64 for sample in samples})
+
+    kept_rows = []
+    kept_genes = []
+    rowfile = None
+    try:
+        if memmap_path is not None:
+            rowfile = open(memmap_path+".rows", "wb")
+        for chunk in reader:
+            chunk = chunk.loc[:, samples].dropna()
+            values = chunk.to_numpy()
+            keep = (values >= cutoff).sum(axis=1) >= num_samples
+            rows = values[keep].astype(dtype)
+            kept_genes.append(chunk.index.to_numpy()[keep])
+            if rowfile is not None:
+                rowfile.write(rows.tobytes())
+            else:
+                kept_rows.append(rows)
+    finally:
+        if rowfile is not None:
+            rowfile.close()
+
+    data_genes = np.concatenate(kept_genes) if kept_genes else np.array([], dtype=object)
+    shape = (len(samples), len(data_genes))
+    if memmap_path is None:
+        data_array = np.empty(shape, dtype=dtype)
+        start = 0
+        for rows in kept_rows:
+            data_array[:, start:start+len(rows)] = rows.T
+            start = start + len(rows)
+    else:
+        # transpose gene rows into the samples x genes file block by block
+        data_array = np.lib.format.open_memmap(memmap_path, mode="w+", 
+                                               dtype=dtype, shape=shape)
+        if shape[1] > 0:
+            rows = np.memmap(memmap_path+".rows", dtype=dtype, mode="r", 
+                             shape=(shape[1], shape[0]))
+            for start in range(0, shape[1], chunksize):
+                data_array[:, start:start+chunksize] = rows[start:start+chunksize].T
+            del rows
+        data_array.flush()
+        del data_array
+        os.remove(memmap_path+".rows")
+        data_array = np.load(memmap_path, mmap_mode="r")
+    return data_array, data_genes, list(samples)
+
+
+def loadExpression(filepath, cutoff=1, num_samples=2, cache_dir=None, 
+                   dtype=np.float32):
+    """
+    Returns the preprocessed expression artifact for a CPM CSV as a
+    dict of "values" (samples x genes, dtype), "above" (samples x genes
+    boolean CPM >= cutoff), "genes" and "samples". Genes failing the
+    EdgeR threshold over all samples are dropped (they fail it for any 
+    sample subset). Use subsetExpression for folds/subsets.
+    :cache_dir: (optional) directory for the on-disk artifact, keyed by 
+                the file's SHA-256 hash, cutoff, num_samples and dtype;
+                artifacts are memory-mapped on load
+    """
+    key = ("expression", gc.sourceKey([filepath], cutoff=cutoff, 
+                                      num_samples=num_samples, dtype=np.dtype(dtype).str))
+    expression = gc.memoryGet(key)
+    if expression is not None:
+        return expression
+    names = ["values", "above", "genes", "samples"]
+
+    entrydir = None
+    if cache_dir is not None:
+        digest = gc.keyDigest((gc.fileHash(filepath), cutoff, num_samples, 
+                               np.dtype(dtype).str))
+        entrydir = os.path.join(cache_dir, "expression-"+digest)
+        if os.path.isfile(os.path.join(entrydir, "samples.npy")):
+            expression = gc.loadArrays(entrydir, names)
+    if expression is None:
+        data = importData(filepath)
+        values = data.to_numpy().T
+        above = values >= cutoff
+        keep = above.sum(axis=0) >= num_samples
+        expression = {"values": np.ascontiguousarray(values[:, keep], dtype=dtype),
+                      "above": np.ascontiguousarray(above[:, keep]),
+                      "genes": data.index.to_numpy(dtype=str)[keep],
+                      "samples": data.columns.to_numpy(dtype=str)}
+        if entrydir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            gc.saveArrays(expression, entrydir)
+            expression = gc.loadArrays(entrydir, names)
+    gc.memoryPut(key, expression)
+    return expression
+
+
+def subsetExpression(expression, samples=None, num_samples=2):
+    """
+    Given an expression artifact (loadExpression) and a list of sample
+    names, returns the samples x genes array and gene names for input
+    into grnboost2, keeping genes with CPM >= cutoff in >= num_samples
+    of the chosen samples (as processData, from the precomputed 
+    threshold matrix).
+    """
+    if samples is None:
+        rows = np.arange(len(expression["samples"]))
+    else:
+        positions = pd.Index(expression["samples"]).get_indexer(samples)
+        if (positions < 0).any():
+            raise ValueError("Samples not found in expression data")
+        rows = positions
+    keep = expression["above"][rows].sum(axis=0) >= num_samples
+    data_array = expression["values"][rows][:, keep]
+    data_genes = expression["genes"][keep]
+    return data_array, data_genes
+
+
 def saveGRN(grn, savedir, fold=None, 
             trainingset=None, testingset=None, 
             suffix=None):
@@ -88,10 +242,178 @@ def saveGRN(grn, savedir, fold=None,
 
 
 
+# Dask scheduling scripts
+def configureEventLoop():
+    """Sets the selector event loop policy required by Dask on Windows"""
+    if sys.platform == "win32":
+        import asyncio
+        if not isinstance(asyncio.get_event_loop_policy(), 
+                          asyncio.WindowsSelectorEventLoopPolicy):
+            asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+
+def startClient(client=None):
+    """
+    Returns a Dask client and whether the caller owns it (and 
+    should shut it down). Uses the given client or scheduler 
+    address, or starts a new LocalCluster if client is None.
+    """
+    if client is not None and not isinstance(client, str):
+        return client, False
+    configureEventLoop()
+    from distributed import Client, LocalCluster
+    if client is None:
+        client = Client(LocalCluster())
+        print(client.dashboard_link)
+        return client, True
+    return Client(client), True
+
+
+def submitGRNBoost2(client, expression_data, gene_names, tf_names, 
+                    seed=None, target_genes="all"):
+    """
+    Submits GRNboost2 inference to a Dask client without blocking.
+    Builds the same graph as arboreto's grnboost2 and returns a 
+    future of the (unsorted) TF-target-importance dataframe along 
+    with the graph, which holds the scattered TF matrix and must 
+    stay referenced until the result is gathered. Sort results by 
+    importance (descending) to match grnboost2 output.
+    """
+    from arboreto.core import create_graph, SGBM_KWARGS
+    graph = create_graph(expression_data, list(gene_names), set(tf_names),
+                         regressor_type="GBM", regressor_kwargs=SGBM_KWARGS,
+                         client=client, target_genes=target_genes, seed=seed)
+    return client.compute(graph), graph
+
+
+
+# library-aware inference scripts
+def planLibraryTargets(gene_names, tf_names, library, outputs=None,
+                       output_regex=False, restrict_tfs=False):
+    """
+    Plans library-aware GRNboost2 inference for refineGRN. Refined
+    edges are library edges into either outputs or library TFs that
+    are library targets of inputs, so only these target genes need
+    regressions (each target is regressed independently, so their
+    importances are unchanged).
+    :library:   library index (buildLibraryIndex) as used by refineGRN
+    :outputs:   (optional) list of output genes (default: OUTPUTS, or
+                regex families over gene_names if output_regex)
+    :restrict_tfs:  (optional) Boolean determining whether only TFs with
+                library edges to the targets are used (approximate, as
+                importances depend on the TFs used as features)
+    Returns a dict of:
+    :targets:   gene_names indices of the targets to regress
+    :witnesses: dict of each input target TF to the gene_names indices
+                of its own library targets (see witnessTargets)
+    :tf_names:  TFs passed to GRNboost2
+    :genes, num_targets, num_witnesses, num_tfs, all_tfs:   counts 
+                (num_witnesses is set by inferLibraryAware)
+    :expected_reduction:    expected fraction of regression work saved
+                (targets x TFs vs. genes x TFs)
+    """
+    gene_index = pd.Index([str(gene) for gene in gene_names])
+    is_tf = gene_index.isin(list(tf_names))
+    if outputs is None:
+        if output_regex:
+            reg_list = "|".join(OUTPUT_REGEX + OUTPUT_REGEX_OTHERS)
+            outputs = gene_index[gene_index.str.contains(reg_list, regex=True)]
+        else:
+            outputs = OUTPUTS
+
+    # library edges between expressed genes, from GRNboost2 TFs
+    positions = gene_index.get_indexer(library["genes"])
+    lib_tfs = positions[library["keys"] >> 32]
+    lib_targets = positions[library["keys"] & 0xFFFFFFFF]
+    possible = (lib_tfs >= 0) & (lib_targets >= 0) & (lib_tfs != lib_targets)
+    possible[possible] = is_tf[lib_tfs[possible]]
+    lib_tfs = lib_tfs[possible]
+    lib_targets = lib_targets[possible]
+
+    # targets: outputs and library TFs targeted by inputs
+    in_tfs = np.zeros(len(gene_index), dtype=bool)
+    in_tfs[lib_tfs] = True
+    is_input = gene_index.isin(INPUTS)
+    input_targets = np.zeros(len(gene_index), dtype=bool)
+    input_targets[lib_targets[is_input[lib_tfs]]] = True
+    input_targets = input_targets & in_tfs
+    targets = input_targets | gene_index.isin(list(outputs))
+    target_positions = np.flatnonzero(targets)
+
+    witnesses = {}
+    for tf in np.flatnonzero(input_targets):
+        witnesses[gene_index[tf]] = lib_targets[lib_tfs == tf].tolist()
+
+    all_tfs = int(is_tf.sum())
+    if restrict_tfs:
+        used = np.zeros(len(gene_index), dtype=bool)
+        used[lib_tfs[targets[lib_targets]]] = True
+        tfs_used = gene_index[used | (is_tf & is_input)].tolist()
+    else:
+        tfs_used = gene_index[is_tf].tolist()
+    expected = 1 - (len(target_positions)*len(tfs_used)) / max(len(gene_index)*all_tfs, 1)
+    return {"targets": target_positions.tolist(),
+            "witnesses": witnesses,
+            "tf_names": tfs_used,
+            "genes": len(gene_index),
+            "num_targets": len(target_positions),
+            "num_witnesses": 0,
+            "num_tfs": len(tfs_used),
+            "all_tfs": all_tfs,
+            "expected_reduction": expected}
+
+
+def witnessTargets(grn, plan, library):
+    """
+    Given the GRN inferred for a plan's targets (planLibraryTargets),
+    returns the gene indices of the further targets needed for an exact
+    refinement: refineGRN keeps an input -> TF edge only if the TF has
+    a library edge in the GRN, so input target TFs without one (that
+    are reached from an input) need regressions of their own library
+    targets. Usually few or none are needed.
+    """
+    grn_targets = filterWithLibrary(grn, library)
+    present = set(grn_targets["TF"].unique())
+    reached = set(grn_targets.loc[grn_targets["TF"].isin(INPUTS), "target"].unique())
+    regressed = set(plan["targets"])
+    extra = set()
+    for tf, tf_targets in plan["witnesses"].items():
+        if tf in reached and tf not in present:
+            extra.update(target for target in tf_targets if target not in regressed)
+    return sorted(extra)
+
+
+def inferLibraryAware(client, expression_data, gene_names, plan, library, seed=None):
+    """
+    Runs GRNboost2 for a plan's targets (planLibraryTargets) plus any
+    witness targets (witnessTargets) on a Dask client and returns the
+    GRN sorted by importance (descending), as grnboost2. Refining it
+    gives the same edges as refining the GRN of all targets when the
+    TFs are not restricted.
+    """
+    def infer(targets):
+        future, graph = submitGRNBoost2(client, expression_data, gene_names,
+                                        plan["tf_names"], seed=seed, target_genes=targets)
+        return future.result()
+
+    if not plan["targets"]:
+        return pd.DataFrame({"TF": [], "target": [], "importance": []})
+    grns = [infer(plan["targets"])]
+    witnesses = witnessTargets(grns[0], plan, library)
+    plan["num_witnesses"] = len(witnesses)
+    if witnesses:
+        grns.append(infer(witnesses))
+    grn = pd.concat(grns, axis=0)
+    return grn.sort_values(by="importance", ascending=False).reset_index(drop=True)
+
+
+
 # runtime scripts
 def inferGRN(filename, 
             libpath, libname, lib_both=True,
-            savedir=None, suffix=None, seed=None):
+            savedir=None, suffix=None, seed=None, workers=None,
+            client=None, chunksize=None, cache_dir=None, profiler=None,
+            netfluxdir=None, library_aware=False, restrict_tfs=False):
     """
     Top-level script for inferring gene regulatory network
     from a given dataset using the Arboreto GRNboost2 algorithm.
@@ -103,40 +425,109 @@ def inferGRN(filename,
                 library (TRANSFACpredicted) for wider TF coverage
     :savedir:   (optional) path to directory for saving final CSV.
     :seed:      (optional) integer for inference algorithm seed
+    :workers:   (optional) number of processes for parallel path search
+                during refinement, or "dask" to run it on the Dask cluster
+    :client:    (optional) Dask client or scheduler address to reuse; by
+                default a LocalCluster is started and shut down
+    :chunksize: (optional) number of gene rows per chunk for out-of-core
+                loading (importDataChunked, float32); default loads the
+                whole CSV with importData
+    :cache_dir: (optional) directory for the cached preprocessed expression
+                matrix (loadExpression, float32), reused across runs, and 
+                the parsed libraries (default libpath/.grncache; False 
+                caches libraries in-process only)
+    :profiler:  (optional) GRNprofile.Profiler recording stage timings
+                (import, preprocessing, grnboost2, refinement stages, save)
+    :netfluxdir:(optional) path to directory for the Netflux model of the
+                refined GRN (see GRNnetflux)
+    :library_aware: (optional) Boolean determining whether GRNboost2 only
+                regresses the target genes that can contribute to refined
+                edges (planLibraryTargets); the refined GRN is unchanged
+    :restrict_tfs:  (optional) Boolean determining whether library-aware
+                inference also restricts the TFs to those with library
+                edges to these targets (faster, but importances change)
     """
+    profiler = gp.getProfiler(profiler)
 
     # import cpm + library data
-    cpm = importData(filename)
-    cpm_array, cpm_genes = processData(cpm)
+    if cache_dir:
+        with profiler.stage("import"):
+            expression = loadExpression(filename, cache_dir=cache_dir)
+        with profiler.stage("preprocessing") as record:
+            cpm_array, cpm_genes = subsetExpression(expression)
+            record["rows"] = len(cpm_genes)
+    elif chunksize is not None:
+        with profiler.stage("import", chunked=True) as record:
+            cpm_array, cpm_genes, _ = importDataChunked(filename, chunksize=chunksize)
+            record["rows"] = len(cpm_genes)
+    else:
+        with profiler.stage("import") as record:
+            cpm = importData(filename)
+            record["rows"] = len(cpm)
+        with profiler.stage("preprocessing") as record:
+            cpm_array, cpm_genes = processData(cpm)
+            record["rows"] = len(cpm_genes)
 
-    tf_all = importTFs(libpath, libname, lib_both)
-    tf_names = tf_all["GeneSym"].to_list()
+    with profiler.stage("library_load", library="TFs") as record:
+        tf_all = importTFs(libpath, libname, lib_both, cache_dir=cache_dir)
+        tf_names = tf_all["GeneSym"].to_list()
+        record["rows"] = len(tf_names)
 
 
     # setup Dask cluster
-    client = Client(LocalCluster())
-    print(client.dashboard_link)
-    
+    client, owns_client = startClient(client)
+
 
 
     # infer + refine GRN
-    grn = grnboost2(expression_data=cpm_array,
-                    gene_names=cpm_genes,
-                    tf_names=tf_names,
-                    client_or_address=client,
-                    seed=seed)
-    grn_refined = refineGRN(grn, libname, dir_path=libpath)
+    library = None
+    if library_aware:
+        with profiler.stage("library_load", library=libname) as record:
+            library = importLibraryIndex(libpath, libname, cache_dir=cache_dir)
+            record["rows"] = len(library["keys"])
+        plan = planLibraryTargets(cpm_genes, tf_names, library, restrict_tfs=restrict_tfs)
+    with profiler.stage("grnboost2", library_aware=library_aware) as record:
+        if library_aware:
+            grn = inferLibraryAware(client, cpm_array, cpm_genes, plan, library, seed=seed)
+            record.update({key: plan[key] for key in ("genes", "num_targets", "num_witnesses", 
+                                                      "num_tfs", "all_tfs", 
+                                                      "expected_reduction")})
+        else:
+            from arboreto.algo import grnboost2
+            grn = grnboost2(expression_data=cpm_array,
+                            gene_names=cpm_genes,
+                            tf_names=tf_names,
+                            client_or_address=client,
+                            seed=seed)
+        record["rows"] = len(grn)
+    if workers == "dask":
+        workers = client
+    grn = CompactGRN.fromFrame(grn, dtype=np.float64)
+    grn_refined = refineGRN(grn, libname, dir_path=libpath, workers=workers, 
+                            library=library, profiler=profiler, 
+                            cache_dir=cache_dir).toFrame()
 
     if savedir is not None:
-        saveGRN(grn_refined, savedir, suffix=suffix)
-
-    client.shutdown()
+        with profiler.stage("save"):
+            saveGRN(grn_refined, savedir, suffix=suffix)
+    if netfluxdir is not None:
+        with profiler.stage("netflux_export"):
+            os.makedirs(netfluxdir, exist_ok=True)
+            gn.exportNetflux(grn_refined, os.path.join(netfluxdir, "Netflux_single" + 
+                                                       ("_"+suffix if suffix is not None else "")))
+
+    if owns_client:
+        client.shutdown()
     return grn_refined
 
 
 def crossvalidateGRN(filename, 
                     libpath, libname, k, lib_both=True,
-                    savedir=None, suffix=None, seed=None):
+                    savedir=None, suffix=None, seed=None, workers=None,
+                    client=None, pipeline=False, 
+                    storedir=None, store_format=None, 
+                    fold_seed=None, resume=True, cache_dir=None, profiler=None,
+                    netfluxdir=None, cutoff=1, num_samples=2):
     """
     Top-level script for k-fold cross validation of gene regulatory 
     network inference using the Arboreto GRNboost2 algorithm.
@@ -149,47 +540,393 @@ def crossvalidateGRN(filename,
                 library (TRANSFACpredicted) for wider TF coverage
     :savedir:   (optional) path to directory for saving final CSV.
     :seed:      (optional) integer for inference algorithm seed
+    :workers:   (optional) number of processes for parallel path search
+                during refinement, or "dask" to run it on the Dask cluster
+    :client:    (optional) Dask client or scheduler address to reuse; by
+                default a LocalCluster is started and shut down
+    :pipeline:  (optional) Boolean determining whether inference for all
+                folds is submitted to the cluster at once, with each fold
+                refined as soon as its inference completes
+    :storedir:  (optional) path to fold-partitioned results store; each
+                fold is written as soon as it finishes (see GRNstore)
+    :store_format:  (optional) store file format ("parquet", "feather" or
+                "csv"; default depends on installed Parquet engines)
+    :fold_seed: (optional) integer seed for the fold shuffle (makeFolds)
+    :resume:    (optional) Boolean determining whether a run recorded in
+                the manifest of storedir (or savedir, without a store) is 
+                resumed: folds are restored from the manifest and completed
+                folds (in the store, or GRN_CV_fold/datasets_CV_fold files
+                in savedir matching the folds) are loaded, not recomputed
+    :cache_dir: (optional) directory for the cached preprocessed expression
+                matrix (loadExpression, float32), whose precomputed threshold
+                matrix then filters the fold subsets, and the parsed libraries
+                (default libpath/.grncache; False caches them in-process only)
+    :profiler:  (optional) GRNprofile.Profiler recording stage timings;
+                fold stages are recorded with a "fold" field
+    :netfluxdir:(optional) path to directory for per-fold Netflux models,
+                each written as soon as its fold is refined (GRNnetflux)
+    :cutoff, num_samples:   (optional) EdgeR threshold applied to each 
+                fold's training samples (CPM >= cutoff in >= num_samples)
+    """
+    grns_refined = {}
+    for fold, grn_refined in iterCrossvalidateGRN(filename, libpath, libname, k,
+                                                  lib_both=lib_both, savedir=savedir, 
+                                                  suffix=suffix, seed=seed, 
+                                                  workers=workers, client=client, 
+                                                  pipeline=pipeline, storedir=storedir, 
+                                                  store_format=store_format,
+                                                  fold_seed=fold_seed, resume=resume,
+                                                  cache_dir=cache_dir, profiler=profiler,
+                                                  netfluxdir=netfluxdir, cutoff=cutoff,
+                                                  num_samples=num_samples):
+        grns_refined[fold] = grn_refined
+    grn_all = pd.concat([grns_refined[fold] for fold in sorted(grns_refined)], axis=0)
+    return grn_all
+
+
+def iterCrossvalidateGRN(filename, 
+                        libpath, libname, k, lib_both=True,
+                        savedir=None, suffix=None, seed=None, workers=None,
+                        client=None, pipeline=False, 
+                        storedir=None, store_format=None, 
+                        fold_seed=None, resume=True, cache_dir=None, profiler=None,
+                        netfluxdir=None, cutoff=1, num_samples=2):
     """
+    Generator version of crossvalidateGRN (same arguments): yields
+    (fold, refined GRN) for each fold as soon as it finishes (in
+    completion order when pipeline=True), so callers only hold the
+    current fold. Finished folds are written to savedir/storedir
+    before they are yielded; when resuming a checkpointed run in
+    storedir (or savedir), completed folds are read back first.
+    """
+    profiler = gp.getProfiler(profiler)
 
     # import cpm + library data
-    cpm = importData(filename)
-
-    tf_all = importTFs(libpath, libname, lib_both)
-    tf_names = tf_all["GeneSym"].to_list()
-
-    # create and assign CV folds
-    folds = gv.makeFolds(cpm, k)
+    with profiler.stage("import") as record:
+        if cache_dir:
+            expression = loadExpression(filename, cutoff=cutoff, num_samples=num_samples,
+                                        cache_dir=cache_dir)
+            cpm = expression["samples"].tolist()
+            foldData = lambda samples: subsetExpression(expression, samples, 
+                                                        num_samples=num_samples)
+            record["rows"] = len(expression["genes"])
+            record["samples"] = len(cpm)
+        else:
+            cpm = importData(filename)
+            foldData = lambda samples: processData(cpm.loc[:, samples], cutoff=cutoff,
+                                                   num_samples=num_samples)
+            record["rows"] = len(cpm)
+            record["samples"] = cpm.shape[1]
+
+    with profiler.stage("library_load", library="TFs") as record:
+        tf_all = importTFs(libpath, libname, lib_both, cache_dir=cache_dir)
+        tf_names = tf_all["GeneSym"].to_list()
+        record["rows"] = len(tf_names)
+
+    # create and assign CV folds (recorded in the run manifest of the 
+    # store, or of savedir without a store)
+    checkdir = storedir if storedir is not None else savedir
+    if checkdir is not None:
+        config = {"filename": os.path.abspath(filename), "libname": libname,
+                  "lib_both": lib_both, "k": k, "seed": seed, "fold_seed": fold_seed,
+                  "cutoff": cutoff, "num_samples": num_samples,
+                  "input_dtype": "float32" if cache_dir else "float64"}
+        manifest = gs.startRun(checkdir, config, 
+                               lambda: gv.makeFolds(cpm, k, seed=fold_seed), 
+                               resume=resume)
+        folds = manifest["folds"]
+    else:
+        folds = gv.makeFolds(cpm, k, seed=fold_seed)
     training, testing = gv.assignFolds(folds)
 
+    # skip folds completed in a previous run
+    completed = []
+    if storedir is not None:
+        completed = gs.completedFolds(storedir, manifest)
+        for fold, grn_refined, _, _ in gs.iterFolds(storedir, folds=completed):
+            grn_refined["fold"] = fold
+            yield fold, grn_refined
+    elif savedir is not None and resume:
+        completed = gs.savedFolds(savedir, training, testing, suffix=suffix)
+        for fold in completed:
+            grn_refined = gs.readSavedFold(savedir, fold, suffix=suffix)
+            grn_refined["fold"] = fold
+            yield fold, grn_refined
+    remaining = [fold for fold in range(k) if fold not in completed]
+    if not remaining:
+        return
+
     # setup Dask cluster
-    client = Client(LocalCluster())
-    print(client.dashboard_link)
-
-    # infer + refine GRN for each fold
-    fold = 0
-    while fold < k:
-        cpm_fold = cpm.loc[:, training[fold]]
-        cpm_array, cpm_genes = processData(cpm_fold)
-
-        grn = grnboost2(expression_data=cpm_array,
-                        gene_names=cpm_genes,
-                        tf_names=tf_names,
-                        client_or_address=client,
-                        seed=seed)
-        grn_refined = refineGRN(grn, libname, dir_path=libpath)
-
-        if savedir is not None:
-            saveGRN(grn_refined, savedir, fold=fold, suffix=suffix, 
-                    trainingset=training, testingset=testing)
-        
-        # store all refined GRNs
-        grn_refined["fold"] = fold
-        if fold == 0:
-            grn_all = grn_refined
+    client, owns_client = startClient(client)
+    if workers == "dask":
+        workers = client
+    from distributed import as_completed
+    from arboreto.algo import grnboost2
+
+    try:
+        # infer + refine GRN for each fold
+        if pipeline:
+            # submit all folds, then refine each as its inference completes
+            futures = {}
+            graphs = {}
+            submitted = {}
+            for fold in remaining:
+                with profiler.stage("preprocessing", fold=fold) as record:
+                    cpm_array, cpm_genes = foldData(training[fold])
+                    record["rows"] = len(cpm_genes)
+                submitted[fold] = time.perf_counter()
+                future, graphs[fold] = submitGRNBoost2(client, cpm_array, cpm_genes, 
+                                                       tf_names, seed=seed)
+                futures[future] = fold
+            for future in as_completed(futures):
+                fold = futures[future]
+                grn = future.result().sort_values(by="importance", ascending=False)
+                future.release()
+                del graphs[fold]
+                # folds share the cluster, so this is time from submission
+                profiler.record("grnboost2", time.perf_counter() - submitted[fold],
+                                fold=fold, rows=len(grn), pipelined=True)
+                yield fold, refineFold(grn, fold, libname, libpath, 
+                                       training, testing, savedir=savedir, 
+                                       suffix=suffix, workers=workers, 
+                                       storedir=storedir, store_format=store_format,
+                                       profiler=profiler, netfluxdir=netfluxdir,
+                                       cache_dir=cache_dir)
         else:
-            grn_all = grn_all.append(grn_refined)
+            for fold in remaining:
+                with profiler.stage("preprocessing", fold=fold) as record:
+                    cpm_array, cpm_genes = foldData(training[fold])
+                    record["rows"] = len(cpm_genes)
+
+                with profiler.stage("grnboost2", fold=fold) as record:
+                    grn = grnboost2(expression_data=cpm_array,
+                                    gene_names=cpm_genes,
+                                    tf_names=tf_names,
+                                    client_or_address=client,
+                                    seed=seed)
+                    record["rows"] = len(grn)
+                yield fold, refineFold(grn, fold, libname, libpath, 
+                                       training, testing, savedir=savedir, 
+                                       suffix=suffix, workers=workers,
+                                       storedir=storedir, store_format=store_format,
+                                       profiler=profiler, netfluxdir=netfluxdir,
+                                       cache_dir=cache_dir)
+    finally:
+        if owns_client:
+            client.shutdown()
+
+
+def refineFold(grn, fold, libname, libpath, training, testing, 
+               savedir=None, suffix=None, workers=None,
+               storedir=None, store_format=None, profiler=None, netfluxdir=None,
+               cache_dir=None):
+    """
+    Refines the inferred GRN of one CV fold, optionally saves it
+    with its training/testing sets (CSV/TXT in savedir and/or the
+    fold store in storedir) and as a Netflux model (netfluxdir), 
+    and tags edges with the fold.
+    """
+    profiler = gp.getProfiler(profiler).bind(fold=fold)
+    grn = CompactGRN.fromFrame(grn, dtype=np.float64)
+    grn_refined = refineGRN(grn, libname, dir_path=libpath, workers=workers, 
+                            profiler=profiler, cache_dir=cache_dir).toFrame()
+
+    # written before the fold is marked complete in the store
+    if netfluxdir is not None:
+        with profiler.stage("netflux_export"):
+            gn.exportFold(netfluxdir, fold, grn_refined, suffix=suffix)
+    if savedir is not None or storedir is not None:
+        with profiler.stage("save"):
+            if savedir is not None:
+                saveGRN(grn_refined, savedir, fold=fold, suffix=suffix, 
+                        trainingset=training, testingset=testing)
+            if storedir is not None:
+                gs.writeFold(storedir, fold, grn_refined, training[fold], testing[fold], 
+                             fmt=store_format)
+            gs.markFoldComplete(storedir if storedir is not None else savedir, fold)
+
+    grn_refined["fold"] = fold
+    return grn_refined
+
 
-        fold = fold + 1
 
-    client.shutdown()
-    return grn_all
\ No newline at end of file
+# ensemble scripts
+def _inferTargets(expression_data, gene_names, tf_indices, target_indices, 
+                  rows=None, seed=None):
+    """
+    Dask task: GRNboost2 regressions (as arboreto's grnboost2) for a
+    block of target genes, on the rows (samples) of a resample of the
+    scattered expression matrix. Returns the TF-target-importance df.
+    """
+    from arboreto.core import infer_partial_network, SGBM_KWARGS
+    if rows is not None:
+        expression_data = expression_data[rows]
+    tf_matrix = expression_data[:, tf_indices]
+    tf_matrix_names = [gene_names[index] for index in tf_indices]
+    links = [infer_partial_network("GBM", SGBM_KWARGS, tf_matrix, tf_matrix_names, 
+                                   gene_names[index], expression_data[:, index], 
+                                   seed=seed)
+             for index in target_indices]
+    return pd.concat(links, axis=0)
+
+
+def iterEnsembleGRN(filename, 
+                    libpath, libname, n=10, mode="seed", lib_both=True, 
+                    seed=None, seeds=None, bootstrap_seed=None,
+                    workers=None, client=None, cache_dir=None, 
+                    target_block=50, profiler=None, max_inflight=2,
+                    cutoff=1, num_samples=2):
+    """
+    Generator for ensemble GRN inference: runs GRNboost2 on n seed
+    repeats or bootstrap resamples of a dataset and yields (member, 
+    refined GRN) for each member as soon as its inference completes.
+    The expression matrix is scattered to the cluster once; each 
+    member's regressions are submitted as blocks of target genes 
+    that only reference it (plus bootstrap sample indices). At most
+    max_inflight members are submitted at a time: the next member is
+    submitted once a finished member has been yielded (and consumed).
+    :n:             number of ensemble members
+    :mode:          "seed" for seed repeats on all samples, or 
+                    "bootstrap" for resamples of the samples (with
+                    replacement) at a fixed seed; the EdgeR threshold is
+                    re-applied to each resample (duplicated samples count
+                    once per draw), so members regress their own genes
+    :seed:          (optional) GRNboost2 seed (bootstrap mode) or first 
+                    seed of the repeats (seed mode; default 0)
+    :seeds:         (optional) list of seeds for seed mode (overrides n)
+    :bootstrap_seed:(optional) integer seed for drawing the resamples
+    :target_block:  number of target genes regressed per Dask task
+    :max_inflight:  maximum number of members submitted to the cluster
+                    but not yet yielded
+    Other arguments as crossvalidateGRN.
+    """
+    profiler = gp.getProfiler(profiler)
+
+    # import cpm + library data (and the CPM >= cutoff matrix of the 
+    # kept genes, for filtering bootstrap resamples)
+    with profiler.stage("import") as record:
+        if cache_dir:
+            expression = loadExpression(filename, cutoff=cutoff, num_samples=num_samples,
+                                        cache_dir=cache_dir)
+            cpm_array, cpm_genes = subsetExpression(expression, num_samples=num_samples)
+            above = expression["above"]
+            above = above[:, above.sum(axis=0) >= num_samples]
+        else:
+            cpm_array, cpm_genes = processData(importData(filename), cutoff=cutoff,
+                                               num_samples=num_samples)
+            above = cpm_array >= cutoff
+        record["rows"] = len(cpm_genes)
+    with profiler.stage("library_load", library="TFs") as record:
+        tf_all = importTFs(libpath, libname, lib_both, cache_dir=cache_dir)
+        tf_names = set(tf_all["GeneSym"].to_list())
+        record["rows"] = len(tf_names)
+    gene_names = [str(gene) for gene in cpm_genes]
+    is_tf = np.array([gene in tf_names for gene in gene_names], dtype=bool)
+    # members' CompactGRNs share one gene vocabulary
+    vocabulary = pd.Index(gene_names, dtype=object)
+
+    # ensemble members: (seed, sample rows)
+    if mode == "seed":
+        if seeds is None:
+            start = 0 if seed is None else seed
+            seeds = list(range(start, start+n))
+        members = [(member_seed, None) for member_seed in seeds]
+    elif mode == "bootstrap":
+        rng = np.random.default_rng(bootstrap_seed)
+        num_rows = cpm_array.shape[0]
+        members = [(seed, np.sort(rng.integers(0, num_rows, num_rows))) 
+                   for _ in range(n)]
+    else:
+        raise ValueError("Unknown ensemble mode: "+str(mode))
+
+    # setup Dask cluster
+    client, owns_client = startClient(client)
+    if workers == "dask":
+        workers = client
+    from distributed import as_completed
+
+    try:
+        # scatter expression matrix once, then submit members as earlier
+        # members are consumed
+        [data_future] = client.scatter([np.ascontiguousarray(cpm_array)], broadcast=True)
+        [names_future] = client.scatter([gene_names], broadcast=True)
+        futures = {}
+        remaining = {}
+        submitted = {}
+        results = {}
+        pending = as_completed()
+
+        def submitMember(member):
+            member_seed, rows = members[member]
+            if rows is None:
+                genes = np.arange(len(gene_names))
+            else:
+                genes = np.flatnonzero(above[rows].sum(axis=0) >= num_samples)
+            tf_indices = genes[is_tf[genes]].tolist()
+            submitted[member] = time.perf_counter()
+            results[member] = []
+            remaining[member] = 0
+            for start in range(0, len(genes), target_block):
+                block = genes[start:start+target_block].tolist()
+                future = client.submit(_inferTargets, data_future, names_future, 
+                                       tf_indices, block, rows=rows, seed=member_seed, 
+                                       pure=False)
+                futures[future] = member
+                pending.add(future)
+                remaining[member] = remaining[member] + 1
+
+        next_member = 0
+        while next_member < min(max_inflight, len(members)):
+            submitMember(next_member)
+            next_member = next_member + 1
+
+        # refine each member as its last block completes
+        for future in pending:
+            member = futures.pop(future)
+            results[member].append(future.result())
+            future.release()
+            remaining[member] = remaining[member] - 1
+            if remaining[member] > 0:
+                continue
+            grn = pd.concat(results.pop(member), axis=0)
+            grn = grn.sort_values(by="importance", ascending=False).reset_index(drop=True)
+            grn = CompactGRN.fromFrame(grn, genes=vocabulary, dtype=np.float64)
+            profiler.record("grnboost2", time.perf_counter() - submitted[member],
+                            member=member, rows=len(grn), pipelined=True)
+            grn_refined = refineGRN(grn, libname, dir_path=libpath, workers=workers,
+                                    profiler=profiler.bind(member=member), 
+                                    cache_dir=cache_dir).toFrame()
+            grn_refined["member"] = member
+            yield member, grn_refined
+            if next_member < len(members):
+                submitMember(next_member)
+                next_member = next_member + 1
+    finally:
+        if owns_client:
+            client.shutdown()
+
+
+def ensembleGRN(filename, 
+                libpath, libname, n=10, mode="seed", lib_both=True, 
+                seed=None, seeds=None, bootstrap_seed=None,
+                workers=None, client=None, cache_dir=None, 
+                target_block=50, profiler=None, min_frequency=0, max_inflight=2,
+                cutoff=1, num_samples=2):
+    """
+    Top-level script for ensemble (seed sweep or bootstrap) GRN
+    inference (same arguments as iterEnsembleGRN). Each refined 
+    member GRN is added to an edge accumulator as it arrives, so 
+    members are not all held in memory. Returns the edge stability 
+    table (GRNconsensus.consensusNetwork: frequency, mean/sd 
+    importance and rank) of edges with frequency >= min_frequency.
+    """
+    accumulator = gcons.newAccumulator()
+    for _, grn_refined in iterEnsembleGRN(filename, libpath, libname, n=n, mode=mode,
+                                          lib_both=lib_both, seed=seed, seeds=seeds,
+                                          bootstrap_seed=bootstrap_seed, workers=workers,
+                                          client=client, cache_dir=cache_dir,
+                                          target_block=target_block, profiler=profiler,
+                                          max_inflight=max_inflight, cutoff=cutoff,
+                                          num_samples=num_samples):
+        gcons.addNetwork(accumulator, grn_refined)
+    return gcons.consensusNetwork(accumulator, min_frequency=min_frequency)
@@ -0,0 +1,205 @@
+"""
+Functions for converting refined GRNs to Netflux models, including:
+- Species and reactions tables with deterministic, path-layer ordered IDs
+- Bulk (column-wise) export to a Netflux spreadsheet or CSV pair
+Netflux: https://github.com/saucermanlab/Netflux
+"""
+
+import os
+import importlib
+import pandas as pd
+import numpy as np
+
+from src.GRNrefinement import INPUTS, OUTPUTS
+
+# default Netflux parameters
+SPECIES_PARAMS = {"Yinit": 0, "Ymax": 1, "tau": 1}
+REACTION_PARAMS = {"weight": 1, "n": 1.4, "EC50": 0.5}
+
+
+def speciesID(genes):
+    """
+    Returns Netflux-safe species IDs for gene names (non-alphanumerics
+    as "_"). Genes mapped to an ID already taken (e.g. NKX2-1 and
+    NKX2_1) get a numeric suffix ("_2", "_3", ...) in the given order.
+    """
+    ids = pd.Index(genes).astype(str).str.replace(r"\W", "_", regex=True)
+    if not ids.has_duplicates:
+        return ids
+    taken = set(ids)
+    seen = set()
+    unique_ids = []
+    for species_id in ids:
+        if species_id in seen:
+            num = 2
+            while species_id+"_"+str(num) in taken:
+                num = num + 1
+            species_id = species_id+"_"+str(num)
+            taken.add(species_id)
+        seen.add(species_id)
+        unique_ids.append(species_id)
+    return pd.Index(unique_ids)
+
+
+def pathLayers(grn, inputs=None, outputs=None):
+    """
+    Given a refined GRN, returns a Series of the layer of each gene
+    along the input-output paths: 0 for inputs, the shortest number
+    of edges from an input for intermediate genes, and one past the
+    deepest intermediate layer for outputs (genes not reached from an
+    input follow all others). Layers are computed level by level over
+    the edge arrays.
+    """
+    if inputs is None:
+        inputs = INPUTS
+    if outputs is None:
+        outputs = OUTPUTS
+    tfs = grn["TF"].to_numpy(dtype=object)
+    targets = grn["target"].to_numpy(dtype=object)
+    genes = pd.Index(pd.unique(np.concatenate([tfs, targets])))
+    tf_codes = genes.get_indexer(tfs)
+    target_codes = genes.get_indexer(targets)
+
+    layers = np.full(len(genes), -1, dtype=np.int64)
+    frontier = np.zeros(len(genes), dtype=bool)
+    frontier[genes.get_indexer([gene for gene in inputs if gene in genes])] = True
+    layer = 0
+    while frontier.any():
+        layers[frontier] = layer
+        reached = np.zeros(len(genes), dtype=bool)
+        reached[target_codes[frontier[tf_codes]]] = True
+        frontier = reached & (layers < 0)
+        layer = layer + 1
+
+    is_output = genes.isin(list(outputs)) & ~(layers == 0)
+    intermediate = (layers > 0) & ~is_output
+    last = layers[intermediate].max() + 1 if intermediate.any() else 1
+    layers[is_output] = last
+    layers[layers < 0] = last + 1
+    return pd.Series(layers, index=genes, name="layer")
+
+
+def netfluxTables(grn, inputs=None, outputs=None, module="", weights=None,
+                  input_weight=None, species_params=None, reaction_params=None):
+    """
+    Converts a refined GRN (refineGRN or consensus output; "TF" and
+    "target" columns) to Netflux species and reactions tables. Species
+    are ordered by path layer (pathLayers), then name; reactions by
+    the layers of their TF and target, then names, so the same network
+    always yields the same IDs and rows.
+    :module:        module name written for every species/reaction
+    :weights:       (optional) None for the default reaction weight, or
+                    a column name (e.g. "importance") scaled to a max of 1
+    :input_weight:  (optional) if given, adds "=> input" reactions with
+                    this weight for each input species
+    :species_params, reaction_params:   (optional) dicts overriding the
+                    default Netflux parameters (SPECIES_PARAMS,
+                    REACTION_PARAMS)
+    Returns species and reactions dataframes.
+    """
+    species_params = {**SPECIES_PARAMS, **(species_params or {})}
+    reaction_params = {**REACTION_PARAMS, **(reaction_params or {})}
+    edges = grn.drop_duplicates(subset=["TF", "target"])
+    layers = pathLayers(edges, inputs=inputs, outputs=outputs)
+
+    # species: sort genes by (layer, name)
+    order = np.lexsort((layers.index.to_numpy(dtype=str), layers.to_numpy()))
+    genes = layers.index[order]
+    gene_layers = layers.to_numpy()[order]
+    ids = speciesID(genes)
+    species = pd.DataFrame({"module": module, "ID": ids, "name": genes.astype(str),
+                            "Yinit": species_params["Yinit"], "Ymax": species_params["Ymax"],
+                            "tau": species_params["tau"]})
+
+    # reactions: sort edges by (TF layer, target layer, TF, target)
+    rank = pd.Series(np.arange(len(genes)), index=genes)
+    tf_rank = rank.reindex(edges["TF"]).to_numpy()
+    target_rank = rank.reindex(edges["target"]).to_numpy()
+    order = np.lexsort((target_rank, tf_rank))
+    gene_ids = pd.Series(ids, index=genes)
+    tf_ids = gene_ids.reindex(edges["TF"]).to_numpy()[order]
+    target_ids = gene_ids.reindex(edges["target"]).to_numpy()[order]
+    if weights is None:
+        weight = np.full(len(order), reaction_params["weight"], dtype=np.float64)
+    else:
+        values = edges[weights].to_numpy(dtype=np.float64)[order]
+        weight = values / values.max() if len(values) else values
+    rules = pd.Series(tf_ids, dtype=object) + " => " + pd.Series(target_ids, dtype=object)
+
+    if input_weight is not None:
+        input_ids = ids[gene_layers == 0].to_numpy(dtype=object)
+        rules = pd.concat([pd.Series("=> " + input_ids, dtype=object), rules],
+                          ignore_index=True)
+        weight = np.concatenate([np.full(len(input_ids), input_weight, dtype=np.float64),
+                                 weight])
+    reactions = pd.DataFrame({"module": module,
+                              "ID": ["r"+str(num) for num in range(1, len(rules)+1)],
+                              "Rule": rules.to_numpy(),
+                              "weight": weight,
+                              "n": reaction_params["n"],
+                              "EC50": reaction_params["EC50"]})
+    return species, reactions
+
+
+# =========================
+# Export functions
+
+def defaultFormat():
+    """Returns "xlsx" if an Excel writer engine is importable, else "csv" """
+    for engine in ("openpyxl", "xlsxwriter"):
+        try:
+            importlib.import_module(engine)
+            return "xlsx"
+        except ImportError:
+            continue
+    return "csv"
+
+
+def writeNetflux(species, reactions, filepath, fmt=None):
+    """
+    Writes Netflux species and reactions tables (netfluxTables) in
+    bulk. "xlsx" writes one workbook with "species" and "reactions"
+    sheets; "csv" writes <filepath>_species.csv and
+    <filepath>_reactions.csv. Files are written to temporary names
+    and renamed, so readers never see partial models.
+    :filepath:  output path (extension is replaced per format)
+    :fmt:       "xlsx" or "csv" (default: defaultFormat())
+    Returns the list of written paths.
+    """
+    if fmt is None:
+        fmt = defaultFormat()
+    base = os.path.splitext(filepath)[0]
+    if fmt == "xlsx":
+        outputs = {base+".xlsx": None}
+        with pd.ExcelWriter(base+".tmp.xlsx") as writer:
+            species.to_excel(writer, sheet_name="species", index=False)
+            reactions.to_excel(writer, sheet_name="reactions", index=False)
+        os.replace(base+".tmp.xlsx", base+".xlsx")
+    elif fmt == "csv":
+        outputs = {base+"_species.csv": species, base+"_reactions.csv": reactions}
+        for path, table in outputs.items():
+            table.to_csv(path+".tmp", index=False)
+            os.replace(path+".tmp", path)
+    else:
+        raise ValueError("Unknown Netflux format: "+str(fmt))
+    return list(outputs)
+
+
+def exportNetflux(grn, filepath, fmt=None, **kwargs):
+    """
+    Converts a refined GRN to a Netflux model and writes it (see
+    netfluxTables for options and writeNetflux for formats).
+    """
+    species, reactions = netfluxTables(grn, **kwargs)
+    return writeNetflux(species, reactions, filepath, fmt=fmt)
+
+
+def exportFold(netfluxdir, fold, grn, suffix=None, fmt=None, **kwargs):
+    """
+    Writes the Netflux model of one CV fold's refined GRN as
+    netfluxdir/Netflux_CV_fold<fold>[_suffix] (named as saveGRN).
+    """
+    os.makedirs(netfluxdir, exist_ok=True)
+    filename = "Netflux_CV_fold"+str(fold)+("_"+suffix if suffix is not None else "")
+    return exportNetflux(grn, os.path.join(netfluxdir, filename), fmt=fmt, 
+                         module="fold"+str(fold), **kwargs)
@@ -0,0 +1,177 @@
+"""
+Stage-level instrumentation for GRN inference and refinement, including:
+- Profiler with a stage context manager (wall/CPU time, peak RSS,
+  row and path counts, per fold)
+- Pluggable record sinks (JSON lines file, in-memory, print)
+- Optional cProfile/tracemalloc capture for chosen stages
+
+Usage:
+    profiler = Profiler(JSONLinesSink("run.jsonl"), cprofile_stages=["dfs"])
+    grn = refineGRN(grn, "CHEA", profiler=profiler)
+"""
+
+import os
+import sys
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:     # Windows
+    resource = None
+
+
+def peakRSS():
+    """Returns the peak resident set size of this process in MB (or None)"""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS, kilobytes elsewhere
+        return peak / 1e6 if sys.platform == "darwin" else peak / 1e3
+    try:
+        import psutil
+    except ImportError:
+        return None
+    info = psutil.Process().memory_info()
+    return getattr(info, "peak_wset", info.rss) / 1e6
+
+
+# =========================
+# Record sinks
+
+class MemorySink:
+    """Collects stage records in a list (e.g. for tests or notebooks)"""
+
+    def __init__(self):
+        self.records = []
+
+    def write(self, record):
+        self.records.append(record)
+
+    def close(self):
+        pass
+
+
+class JSONLinesSink:
+    """Appends stage records to a JSON lines file, one record per line"""
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.output = open(filepath, "a")
+
+    def write(self, record):
+        self.output.write(json.dumps(record, default=str) + "\n")
+        self.output.flush()
+
+    def close(self):
+        self.output.close()
+
+
+class PrintSink:
+    """Prints one line per stage record"""
+
+    def write(self, record):
+        counts = ", ".join(key+"="+str(record[key]) for key in ("fold", "rows", "paths")
+                           if key in record)
+        print(record["stage"]+": "+"{:.3f}".format(record["wall_s"])+" s"+
+              (" ("+counts+")" if counts else ""))
+
+    def close(self):
+        pass
+
+
+# =========================
+# Profiler
+
+class Profiler:
+    """
+    Records per-stage telemetry to a sink. Context fields (e.g. fold,
+    dataset) given to the constructor or bind() are added to every
+    record.
+    :sink:              object with write(record) (default: MemorySink)
+    :cprofile_stages:   (optional) stage names run under cProfile; stats
+                        are written to profile_dir and their path recorded
+    :tracemalloc_stages:(optional) stage names run under tracemalloc; the
+                        traced Python allocation peak is recorded
+    :profile_dir:       directory for cProfile stats (default: cwd)
+    """
+
+    def __init__(self, sink=None, cprofile_stages=(), tracemalloc_stages=(),
+                 profile_dir=None, **context):
+        self.sink = MemorySink() if sink is None else sink
+        self.cprofile_stages = set(cprofile_stages)
+        self.tracemalloc_stages = set(tracemalloc_stages)
+        self.profile_dir = os.getcwd() if profile_dir is None else profile_dir
+        self.context = context
+
+    def bind(self, **context):
+        """Returns a profiler writing to the same sink with extra context fields"""
+        return Profiler(self.sink, self.cprofile_stages, self.tracemalloc_stages,
+                        self.profile_dir, **{**self.context, **context})
+
+    def record(self, stage, wall_s, **fields):
+        """Writes a record for a stage timed elsewhere (e.g. on a Dask cluster)"""
+        record = {"stage": stage, "wall_s": wall_s, **self.context, **fields}
+        self.sink.write(record)
+        return record
+
+    @contextmanager
+    def stage(self, stage, **fields):
+        """
+        Context manager timing the enclosed block as stage. Yields the
+        record dict, so the block can add counts (e.g. record["rows"]).
+        """
+        record = {"stage": stage, **self.context, **fields}
+        profile = None
+        if stage in self.cprofile_stages:
+            import cProfile
+            profile = cProfile.Profile()
+        trace = stage in self.tracemalloc_stages and not tracemalloc.is_tracing()
+        if trace:
+            tracemalloc.start()
+        if profile is not None:
+            profile.enable()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield record
+        finally:
+            record["wall_s"] = time.perf_counter() - wall
+            record["cpu_s"] = time.process_time() - cpu
+            if profile is not None:
+                profile.disable()
+                name = "_".join([stage]+[str(value) for value in self.context.values()])
+                record["cprofile"] = os.path.join(self.profile_dir, name+".pstats")
+                profile.dump_stats(record["cprofile"])
+            if trace:
+                record["traced_peak_mb"] = tracemalloc.get_traced_memory()[1] / 1e6
+                tracemalloc.stop()
+            record["peak_rss_mb"] = peakRSS()
+            self.sink.write(record)
+
+    def records(self):
+        """Returns collected records (MemorySink only)"""
+        return getattr(self.sink, "records", None)
+
+
+class NullProfiler(Profiler):
+    """Profiler that times nothing and discards records"""
+
+    def bind(self, **context):
+        return self
+
+    def record(self, stage, wall_s, **fields):
+        return {}
+
+    @contextmanager
+    def stage(self, stage, **fields):
+        yield {}
+
+
+_null_profiler = NullProfiler()
+
+
+def getProfiler(profiler=None):
+    """Returns profiler, or a no-op profiler if None"""
+    return _null_profiler if profiler is None else profiler
@@ -3,9 +3,15 @@ Functions for refining GRN as inferred from Arboreto
 """
 
 import os
+import time
+import heapq
 import pandas as pd
 import numpy as np
 
+import src.GRNcache as gc
+import src.GRNprofile as gp
+from src.GRNcompact import CompactGRN
+
 # Library filtering functions
 def getLibPath(start_directory, sub_directory, filter_extension=None):
     """
@@ -18,33 +24,125 @@ def getLibPath(start_directory, sub_directory, filter_extension=None):
                 return os.path.join(root, file)
 
 
-def importLibraries(dirpath, libraryname, both=True):
+def readLibraries(libfiles):
     """
-    Using filename of GRN, imports libraries of TF-target interactions.
-    :dirpath:   name of top-level directory containing library folders.
-    :filename:  name of library to use 
-                    Library options: CHEA, TRANSFAC, ENCODE
+    Parses Harmonizome TF-target edge files and returns the
+    combined library (duplicates and header rows removed).
     """
-    libextension = "_gene_attribute_edges.txt.gz"
-    libfile = getLibPath(dirpath, libraryname, filter_extension=libextension)
-    library = pd.read_csv(libfile, 
+    library = None
+    for libfile in libfiles:
+        library_file = pd.read_csv(libfile, 
                         index_col=None, header=0, 
                         low_memory=False, sep=r"\s+")
+        if library is None:
+            library = library_file
+        else:
+            library = pd.concat([library,library_file], axis=0).drop_duplicates()
+    return library.drop(index=0)
+
+
+def libraryFiles(dirpath, libraryname, both=True):
+    """Returns list of TF-target edge files used for a library"""
+    libextension = "_gene_attribute_edges.txt.gz"
+    libfiles = [getLibPath(dirpath, libraryname, filter_extension=libextension)]
     if both:
         libname = "TRANSFACpredicted"
-        libfile = getLibPath(dirpath, libname, filter_extension=libextension)
-        library2 = pd.read_csv(libfile, 
-                        index_col=None, header=0, 
-                        low_memory=False, sep=r"\s+")
-        library = pd.concat([library,library2], axis=0).drop_duplicates()
-    return library.drop(index=0)
+        libfiles.append(getLibPath(dirpath, libname, filter_extension=libextension))
+    return libfiles
+
+
+def importLibraries(dirpath, libraryname, both=True, cache=True, cache_dir=None):
+    """
+    Using filename of GRN, imports libraries of TF-target interactions.
+    :dirpath:   name of top-level directory containing library folders.
+    :filename:  name of library to use 
+                    Library options: CHEA, TRANSFAC, ENCODE
+    :both:      Boolean determining use of additional library 
+                (TRANSFACpredicted)
+    :cache:     Boolean determining use of the parsed-library cache
+                (in-process and on disk, see GRNcache); cached libraries
+                are copies with category-coded columns (use cache=False
+                for object columns)
+    :cache_dir: (optional) directory for the on-disk cache (default 
+                dirpath/.grncache; False keeps it in-process only)
+    """
+    libfiles = libraryFiles(dirpath, libraryname, both=both)
+    if not cache:
+        return readLibraries(libfiles)
+    tag = "library_"+libraryname+("_both" if both else "")
+    return gc.loadCached(libfiles, lambda: readLibraries(libfiles), tag,
+                         cache_dir=gc.cacheDir(dirpath, cache_dir))
+
+
+def _columnCodes(values, genes):
+    """Codes a (categorical) gene column against genes; -1 if absent"""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        category_codes = np.append(genes.get_indexer(values.cat.categories), -1)
+        return category_codes[values.cat.codes.to_numpy()]
+    return genes.get_indexer(values)
+
+
+def _pairKeys(tf_codes, target_codes):
+    """Packs (TF, target) code pairs into int64 keys; -1 if either is absent"""
+    keys = (tf_codes.astype(np.int64) << 32) | target_codes.astype(np.int64)
+    keys[(tf_codes < 0) | (target_codes < 0)] = -1
+    return keys
+
+
+def buildLibraryIndex(library):
+    """
+    Given a library df (as importLibraries), returns an index of
+    its TF-target pairs for filterWithLibrary: the gene vocabulary
+    and the sorted, unique int64-packed (TF, target) code pairs.
+    Note: library "target" column holds TFs, "source" their targets.
+    """
+    tfs = library["target"]
+    targets = library["source"]
+    genes = pd.Index(pd.concat([pd.Series(tfs.unique()), pd.Series(targets.unique())],
+                               ignore_index=True).dropna().unique())
+    keys = _pairKeys(_columnCodes(tfs, genes), _columnCodes(targets, genes))
+    keys = np.unique(keys[keys >= 0])
+    return {"genes": genes, "keys": keys}
+
+
+def importLibraryIndex(dirpath, libraryname, both=True, cache=True, cache_dir=None):
+    """
+    Returns the library index (buildLibraryIndex) for a library,
+    built once per library version and shared in-process (the
+    index is read-only). cache and cache_dir as importLibraries.
+    """
+    if not cache:
+        return buildLibraryIndex(importLibraries(dirpath, libraryname, both=both, cache=False))
+    libfiles = libraryFiles(dirpath, libraryname, both=both)
+    key = ("library_index", gc.sourceKey(libfiles))
+    library_index = gc.memoryGet(key)
+    if library_index is None:
+        library_index = buildLibraryIndex(importLibraries(dirpath, libraryname, both=both,
+                                                          cache_dir=cache_dir))
+        gc.memoryPut(key, library_index)
+    return library_index
+
 
 def filterWithLibrary(grn, library):
-    """given a grn df and library df, finds edges matching
-    the library and returns filtered grn with matching edges"""
-    grn_pairs = grn["TF"]+"-"+grn["target"]
-    lib_pairs = library["target"]+"-"+library["source"]
-    inLibrary = grn_pairs.isin(lib_pairs)
+    """given a grn df and library df (or library index from 
+    buildLibraryIndex), finds edges matching the library and
+    returns filtered grn with matching edges (grn may be a
+    CompactGRN; its vocabulary is coded against the library once)"""
+    if isinstance(library, pd.DataFrame):
+        library = buildLibraryIndex(library)
+    genes = library["genes"]
+    if isinstance(grn, CompactGRN):
+        vocab_codes = genes.get_indexer(grn.genes)
+        grn_keys = _pairKeys(vocab_codes[grn.tf], vocab_codes[grn.target])
+    else:
+        grn_keys = _pairKeys(_columnCodes(grn["TF"], genes), _columnCodes(grn["target"], genes))
+    lib_keys = library["keys"]
+    inLibrary = np.zeros(len(grn_keys), dtype=bool)
+    if len(lib_keys):
+        positions = np.minimum(np.searchsorted(lib_keys, grn_keys), len(lib_keys)-1)
+        inLibrary = (grn_keys >= 0) & (lib_keys[positions] == grn_keys)
+    if isinstance(grn, CompactGRN):
+        return grn.take(inLibrary)
     grn_filtered = grn.loc[inLibrary, :]
     return grn_filtered
 
@@ -54,13 +152,18 @@ def filterWithLibrary(grn, library):
 
 def findOutputs(grn, *regs, indivregs=None):
     """Given regex strings for output gene families, 
-    finds outputs included in full GRN"""
+    finds outputs included in full GRN (in order of 
+    first appearance; regex is matched once per gene)"""
     if indivregs is not None:
         reg_list = "|".join((regs) + indivregs)
     else:
         reg_list = "|".join((regs))
 
-    outputs = grn.loc[grn["target"].str.contains(reg_list, regex=True).values,"target"].unique()
+    if isinstance(grn, CompactGRN):
+        targets = pd.Series(grn.genes[pd.unique(grn.target)])
+        return targets[targets.str.contains(reg_list, regex=True).values].to_numpy()
+    targets = pd.Series(grn["target"].unique())
+    outputs = targets[targets.str.contains(reg_list, regex=True).values].unique()
     return outputs
 
 
@@ -68,34 +171,37 @@ def findInputsOrOutputs(grn,values,column):
     """
     Given a list of gene names, 
     finds names located in either TF or target columns in GRN
+    (unique names, in the order given)
     """
-    vals_any = []
-    for val in values:
-        val_any = grn[column].isin([val]).any()
-        vals_any.append(val_any)
-    vals_dict = dict(zip(values,vals_any))
-    # filter dictionary for true items
-    keys = []
-    for item in vals_dict.items():
-        if item[1] == True:
-            keys.append(item[0])
+    if isinstance(grn, CompactGRN):
+        present = set(grn.genes[np.unique(grn.column(column))])
+    else:
+        present = set(grn[column].unique())
+    keys = [val for val in dict.fromkeys(values) if val in present]
     return keys
 
 
 def filterInputsOrOutputs(grn,keys,column):
     """Given a list of gene names and the corresponding
     column, returns a filtered GRN containing only
-    elements in the list."""
-    for key in keys:
-        grn_key = grn.loc[grn[column]==key,:]
-        # remove 'index' column if necessary 
-        # (in order to avoid issues with concatenation)
-        if grn.columns.isin(["index"]).any():
-            grn_key = grn_key.drop(columns=["index"])
-        if key == keys[0]:
-            grn_filt = grn_key
-        else:
-            grn_filt = pd.concat([grn_filt, grn_key], axis=0)
+    elements in the list, grouped by key in list order."""
+    keys = list(dict.fromkeys(keys))
+    # position of each edge's gene in keys (-1 if not a key)
+    if isinstance(grn, CompactGRN):
+        key_positions = np.full(len(grn.genes)+1, -1, dtype=np.int64)
+        key_codes = grn.codesOf(keys)
+        key_positions[key_codes[key_codes >= 0]] = np.flatnonzero(key_codes >= 0)
+        positions = key_positions[grn.column(column)]
+        rows = np.flatnonzero(positions >= 0)
+        return grn.take(rows[np.argsort(positions[rows], kind="stable")])
+    positions = pd.Index(keys, dtype=object).get_indexer(grn[column])
+    rows = np.flatnonzero(positions >= 0)
+    rows = rows[np.argsort(positions[rows], kind="stable")]
+    grn_filt = grn.iloc[rows, :]
+    # remove 'index' column if necessary 
+    # (in order to avoid issues with concatenation)
+    if grn.columns.isin(["index"]).any():
+        grn_filt = grn_filt.drop(columns=["index"])
     return grn_filt
 
 
@@ -104,6 +210,8 @@ def filterInOutNetwork(grn_in, grn_out, grn_targets, include_intermediates=False
     and those included in libraries, function returns a subnetwork
     containing edges leading from inputs to outputs via intermediate
     TFs, with optional inclusion of indermediate (TF-TF) edges"""
+    if isinstance(grn_targets, CompactGRN):
+        return _filterInOutCompact(grn_in, grn_out, grn_targets, include_intermediates)
     tfs = grn_targets["TF"].unique()
     in_tf = grn_in.loc[grn_in["target"].isin(tfs), :]
     tf_out = grn_out        # assumed b/c of TF column
@@ -121,105 +229,555 @@ def filterInOutNetwork(grn_in, grn_out, grn_targets, include_intermediates=False
     return grn_filtered
 
 
+def _filterInOutCompact(grn_in, grn_out, grn_targets, include_intermediates=False):
+    """filterInOutNetwork for CompactGRNs, as membership tests on codes"""
+    is_tf = np.zeros(len(grn_targets.genes), dtype=bool)
+    is_tf[grn_targets.tf] = True
+    in_tf = grn_in.take(is_tf[grn_in.target])
+    tf_out = grn_out
+    if include_intermediates:
+        grn_tfs = grn_targets.take(is_tf[grn_targets.target])
+        in_targets = np.zeros(len(grn_targets.genes), dtype=bool)
+        in_targets[in_tf.target] = True
+        out_tfs = np.zeros(len(grn_targets.genes), dtype=bool)
+        out_tfs[tf_out.tf] = True
+        tftf = grn_tfs.take(in_targets[grn_tfs.tf] & out_tfs[grn_tfs.target])
+        return CompactGRN.concat([in_tf, tftf, tf_out])
+    return CompactGRN.concat([in_tf, tf_out])
+
+
+# =========================
+# Indexed adjacency functions
+
+def buildAdjacency(grn):
+    """
+    Given a GRN df, returns an integer-coded adjacency index
+    for path searches. Genes are coded once against a shared
+    vocabulary and edges are grouped CSR-style by TF (out-
+    neighbours) and by target (in-neighbours), keeping the
+    original row order within each group.
+    """
+    if isinstance(grn, CompactGRN):
+        # recode the vocabulary codes compactly (order of appearance)
+        tf_values = grn.tf
+        codes, uniques = pd.factorize(np.concatenate([grn.tf, grn.target]))
+        genes = grn.genes[uniques]
+        importance = grn.importance.astype(np.float64)
+    else:
+        tf_values = grn["TF"].to_numpy()
+        codes, genes = pd.factorize(np.concatenate([tf_values, grn["target"].to_numpy()]))
+        importance = grn["importance"].to_numpy(dtype=np.float64)
+    tf_codes = codes[:len(tf_values)]
+    target_codes = codes[len(tf_values):]
+    num_genes = len(genes)
+
+    out_edges = np.argsort(tf_codes, kind="stable")
+    out_ptr = np.zeros(num_genes+1, dtype=np.int64)
+    out_ptr[1:] = np.cumsum(np.bincount(tf_codes, minlength=num_genes))
+    in_edges = np.argsort(target_codes, kind="stable")
+    in_ptr = np.zeros(num_genes+1, dtype=np.int64)
+    in_ptr[1:] = np.cumsum(np.bincount(target_codes, minlength=num_genes))
+
+    adjacency = {"genes": list(genes),
+                 "codes": dict(zip(genes, range(num_genes))),
+                 "TF": tf_codes,
+                 "target": target_codes,
+                 "importance": importance,
+                 "out_ptr": out_ptr,
+                 "out_edges": out_edges,
+                 "in_ptr": in_ptr,
+                 "in_edges": in_edges,
+                 "quantiles": {},
+                 "masks": {},
+                 "searches": {}}
+    return adjacency
+
+
+def nodeQuantiles(adjacency, q, direction="out"):
+    """
+    Given an adjacency index, returns the q-quantile of edge
+    importances for each gene, using out-edges (TF neighbours)
+    or in-edges (target neighbours). Matches pandas quantile
+    (linear interpolation); genes without edges are NaN.
+    Results are cached on the index per (direction, q).
+    """
+    key = (direction, q)
+    if key in adjacency["quantiles"]:
+        return adjacency["quantiles"][key]
+    ptr = adjacency[direction+"_ptr"]
+    edges = adjacency[direction+"_edges"]
+    groups = adjacency["TF" if direction == "out" else "target"][edges]
+    values = adjacency["importance"][edges]
+    values = values[np.lexsort((values, groups))]
+
+    counts = np.diff(ptr)
+    has_edges = counts > 0
+    # pandas passes q through np.percentile (q*100, then /100)
+    virtual = (counts[has_edges]-1) * ((q*100)/100)
+    lower = np.floor(virtual)
+    gamma = virtual - lower
+    lower = lower.astype(np.int64)
+    upper = np.minimum(lower+1, counts[has_edges]-1)
+    a = values[ptr[:-1][has_edges] + lower]
+    b = values[ptr[:-1][has_edges] + upper]
+    diff = b - a
+    interp = np.where(gamma >= 0.5, b - diff*(1-gamma), a + diff*gamma)
+
+    quantiles = np.full(len(counts), np.nan)
+    quantiles[has_edges] = interp
+    adjacency["quantiles"][key] = quantiles
+    return quantiles
+
+
+def edgeRuleMasks(adjacency, rules):
+    """
+    Given an adjacency index and search rules, returns boolean
+    edge masks for the top-down rule (importance above the
+    absolute cutoff or the TF's out-edge quantile) and the
+    bottom-up rule (importance at or above the absolute cutoff
+    or the target's in-edge quantile).
+    Results are cached on the index per rules setting.
+    """
+    key = (rules[0], rules[1])
+    masks = adjacency.setdefault("masks", {})
+    if key in masks:
+        return masks[key]
+    importance = adjacency["importance"]
+    quant_out = nodeQuantiles(adjacency, rules[1], "out")[adjacency["TF"]]
+    quant_in = nodeQuantiles(adjacency, rules[1], "in")[adjacency["target"]]
+    keep_topdown = (importance > rules[0]) | (importance > quant_out)
+    keep_bottomup = (importance >= rules[0]) | (importance >= quant_in)
+    masks[key] = (keep_topdown, keep_bottomup)
+    return masks[key]
+
+
+def searchStructure(adjacency, rules):
+    """
+    Given an adjacency index and search rules, returns the
+    out-neighbour lists used by the DFS: CSR pointers,
+    neighbour codes and bottom-up rule flags for the edges
+    kept by the top-down rule. Cached per rules setting.
+    """
+    key = (rules[0], rules[1])
+    if key in adjacency["searches"]:
+        return adjacency["searches"][key]
+    keep_topdown, keep_bottomup = edgeRuleMasks(adjacency, rules)
+    out_edges = adjacency["out_edges"]
+    kept = keep_topdown[out_edges]
+    edges = out_edges[kept]
+    ptr = np.concatenate([[0], np.cumsum(kept)])[adjacency["out_ptr"]]
+    search = {"ptr": ptr.tolist(),
+              "neighbors": adjacency["target"][edges].tolist(),
+              "bottomup": keep_bottomup[edges].tolist(),
+              "importance": adjacency["importance"][edges].tolist(),
+              "edges": edges.tolist()}
+    adjacency["searches"][key] = search
+    return search
+
+
 # =========================
 # Simultaneous top-down + bottom-up DFS scripts
 
-def testPathInv(path,grn,rules):
-    """Test that a found path meets bottom-up search requirements"""
+def testPathInv(path,grn,rules,adjacency=None):
+    """
+    Test that a found path meets bottom-up search requirements.
+    Callers testing many paths should pass a shared adjacency
+    index (buildAdjacency) of grn: the rule masks are cached on
+    it, whereas without one the index is rebuilt on every call.
+    """
+    if adjacency is None:
+        adjacency = buildAdjacency(grn)
+    _, keep_bottomup = edgeRuleMasks(adjacency, rules)
+    codes = adjacency["codes"]
+    in_ptr = adjacency["in_ptr"]
     meetsRules = []
     for item in range(len(path)):
         if item < len(path)-1:
-            target = path[item]
-            TF = path[item+1]
-            toTest = grn.loc[(grn["target"]==target) & (grn["TF"]==TF),"importance"]
-            neighbors_all = grn.loc[grn["target"]==target,:]
-            quant = neighbors_all["importance"].quantile(q=rules[1])
-            if ((toTest >= rules[0]).bool()) | ((toTest >= quant).bool()):
-                meetsRules.extend([True])
-            else:
-                meetsRules.extend([False])
+            target = codes.get(path[item], -1)
+            TF = codes.get(path[item+1], -1)
+            if target < 0 or TF < 0:
+                raise ValueError("Edge "+str(path[item+1])+"->"+str(path[item])+" not found in GRN")
+            edges = adjacency["in_edges"][in_ptr[target]:in_ptr[target+1]]
+            toTest = edges[adjacency["TF"][edges] == TF]
+            if len(toTest) != 1:
+                raise ValueError("Edge "+str(path[item+1])+"->"+str(path[item])+" not found in GRN")
+            meetsRules.extend([bool(keep_bottomup[toTest[0]])])
     return all(meetsRules)
 
 
-def findPathsBoth(grn,start,output_keys,rules=[1,0.5]):
+def findPathsBoth(grn,start,output_keys,rules=[1,0.5],adjacency=None,
+                  max_length=None,top_k=None,score="total",
+                  max_visits=None,time_budget=None):
     """
-    Given a network of pairwise TF-target interactions, a 
-    starting TF, and a set of output genes, 1) uses a top-down 
-    search algorithm to find paths between the input and outputs, 
-    and 2) checks that found paths meets the same rules for a 
+    Given a network of pairwise TF-target interactions, a
+    starting TF, and a set of output genes, 1) uses a top-down
+    search algorithm to find paths between the input and outputs,
+    and 2) checks that found paths meets the same rules for a
     bottom-up search.
+    Optionally takes a prebuilt adjacency index (buildAdjacency)
+    of grn to share across searches. Paths are yielded as found.
+    :max_length:    (optional) maximum number of edges in a path
+    :top_k:         (optional) only yield the top_k paths by score, 
+                    found by best-first branch-and-bound search and
+                    yielded best first
+    :score:         "total" or "mean" path importance (as scorePaths)
+                    used to rank paths for top_k
+    :max_visits:    (optional) maximum number of expanded search nodes
+    :time_budget:   (optional) maximum search time in seconds
+    When a budget runs out, the search stops with the paths found 
+    so far (for top_k, the best paths found so far).
+    """
+    if adjacency is None:
+        adjacency = buildAdjacency(grn)
+    codes = adjacency["codes"]
+    if start not in codes:
+        return
+    genes = adjacency["genes"]
+    outputs = set(codes[key] for key in output_keys if key in codes)
+    search = searchStructure(adjacency, rules)
+    arrays = (search["ptr"], search["neighbors"], search["bottomup"], search["importance"])
+    for path in _searchInput(arrays, codes[start], outputs, 
+                             max_length=max_length, top_k=top_k, score=score, 
+                             max_visits=max_visits, time_budget=time_budget):
+        yield [genes[node] for node in path]
+
+
+def _searchInput(arrays, start, outputs, max_length=None, top_k=None, score="total",
+                 max_visits=None, time_budget=None):
+    """
+    Dispatches the search from one input to the DFS or top-k
+    search; arrays are the CSR pointers, neighbours, bottom-up
+    flags and edge importances.
+    """
+    deadline = None if time_budget is None else time.monotonic() + time_budget
+    if top_k is None:
+        return _searchPaths(arrays[0], arrays[1], arrays[2], start, outputs, 
+                            max_length=max_length, max_visits=max_visits, 
+                            deadline=deadline)
+    return _searchTopPaths(*arrays, start, outputs, top_k, score=score, 
+                           max_length=max_length, max_visits=max_visits, 
+                           deadline=deadline)
+
+
+def _searchPaths(ptr, neighbors, bottomup, start, outputs,
+                 max_length=None, max_visits=None, deadline=None):
     """
-    stack = [(start,[start])]
+    DFS core of findPathsBoth over CSR search sequences (lists
+    or memoryviews); yields paths as tuples of gene codes.
+    """
+    # stack entries carry whether every edge so far meets the bottom-up rule
+    stack = [(start,(start,),True)]
+    visits = 0
     while stack:
-        (vertex,path) = stack.pop()
-        neighbors_all = grn.loc[grn["TF"]==vertex,:]
-        quant = neighbors_all["importance"].quantile(q=rules[1])
-        toKeep = ((neighbors_all["importance"]>rules[0]) | (neighbors_all["importance"]>quant))
-        neighbors = neighbors_all.loc[toKeep,"target"]
-        for neigh in neighbors:
+        if max_visits is not None and visits >= max_visits:
+            return
+        if deadline is not None and visits % 1024 == 0 and time.monotonic() > deadline:
+            return
+        visits = visits + 1
+        (vertex,path,meetsInv) = stack.pop()
+        # paths of max_length edges can only end at this vertex's outputs
+        extend = max_length is None or len(path) < max_length
+        for idx in range(ptr[vertex], ptr[vertex+1]):
+            neigh = neighbors[idx]
             if neigh not in path:
-                if neigh in output_keys:
-                    meetsInvRules = testPathInv(list(reversed(path + [neigh])),grn,rules)
+                meetsInvRules = meetsInv and bottomup[idx]
+                if neigh in outputs:
                     if meetsInvRules:
-                        yield path + [neigh]
-                else:
-                    stack.append((neigh, path + [neigh]))
-
-
-def findPathImps(grn,pathlist):
-    """
-    
-    """
-    tot_imp = []
-    vars_imp = []
-    for paths in pathlist:
-        path_imp = []
-        for item in range(len(paths)):
-            if item < len(paths)-1:
-                TF = paths[item]
-                target = paths[item+1]
-                criteria = ((grn["TF"] == TF) & (grn["target"] == target))
-                imp = grn.loc[criteria, "importance"]
-                if item == 0:
-                    path_imp = [float(imp)]
-                else:
-                    path_imp = path_imp + [float(imp)]
-        tot_imp.extend([np.sum(path_imp)])
-        vars_imp.extend([np.std(path_imp)])
-    paths_imp = pd.DataFrame(data=[pathlist, tot_imp, vars_imp], 
-                             index=["path", "importance_total", "importance_sd"]).transpose()
-    
-    # add additional metrics + metadata
-    paths_imp["importance_mean"] = paths_imp["importance_total"] / paths_imp["path"].str.len()
-    paths_imp["importance_cv"] = paths_imp["importance_sd"] / paths_imp["importance_mean"]
-    paths_str = []
-    for _, series in paths_imp.iterrows():
-        paths_str.extend([''.join('->'+str(i) for i in series["path"])[2:]])
-    paths_imp["path_string"] = paths_str
-    paths_imp["input"] = paths_imp["path"].str[0]
-    paths_imp["output"] = paths_imp["path"].str[-1]
-    paths_imp["TF"] = paths_imp["path"].str[-2]
+                        yield path + (neigh,)
+                elif meetsInvRules and extend:
+                    # paths through an edge failing the bottom-up rule never yield
+                    stack.append((neigh, path + (neigh,), meetsInvRules))
+
+
+def _searchTopPaths(ptr, neighbors, bottomup, importance, start, outputs, top_k,
+                    score="total", max_length=None, max_visits=None, deadline=None):
+    """
+    Best-first branch-and-bound version of _searchPaths keeping the
+    top_k paths by total or mean edge importance (mean over path
+    genes, as scorePaths) in a bounded min-heap. Partial paths are
+    expanded in order of an upper bound on the score of any path 
+    extending them, and the search stops once no partial path can 
+    beat the k-th best path. Returns paths best first.
+    """
+    if top_k <= 0:
+        return []
+    max_imp = max(importance) if len(importance) else 0
+    num_nodes = len(ptr) - 1
+
+    def bound(total, nodes):
+        edges_left = num_nodes - nodes
+        if max_length is not None:
+            edges_left = min(edges_left, max_length - (nodes-1))
+        edges_left = max(edges_left, 0)
+        if score == "mean":
+            # a mean only exceeds its current value via edges above it
+            return max(total/nodes, max_imp) if edges_left else total/nodes
+        return total + edges_left*max_imp
+
+    best = []           # min-heap of (score, -order, path)
+    order = 0
+    frontier = [(-bound(0, 1), order, start, (start,), 0)]
+    visits = 0
+    while frontier:
+        if max_visits is not None and visits >= max_visits:
+            break
+        if deadline is not None and visits % 1024 == 0 and time.monotonic() > deadline:
+            break
+        (neg_bound, _, vertex, path, total) = heapq.heappop(frontier)
+        if len(best) == top_k and -neg_bound <= best[0][0]:
+            break
+        visits = visits + 1
+        extend = max_length is None or len(path) < max_length
+        for idx in range(ptr[vertex], ptr[vertex+1]):
+            neigh = neighbors[idx]
+            if neigh in path or not bottomup[idx]:
+                continue
+            path_next = path + (neigh,)
+            total_next = total + importance[idx]
+            order = order + 1
+            if neigh in outputs:
+                value = total_next/len(path_next) if score == "mean" else total_next
+                if len(best) < top_k:
+                    heapq.heappush(best, (value, -order, path_next))
+                elif value > best[0][0]:
+                    heapq.heapreplace(best, (value, -order, path_next))
+            elif extend:
+                upper = bound(total_next, len(path_next))
+                if len(best) < top_k or upper > best[0][0]:
+                    heapq.heappush(frontier, (-upper, order, neigh, path_next, total_next))
+    return [path for _, _, path in sorted(best, reverse=True)]
+
+
+# =========================
+# Parallel path search functions
+
+_worker_search = None
+
+def _int64View(array):
+    """Zero-copy memoryview of an int64 array with native item access"""
+    return memoryview(array).cast("B").cast("q")
+
+
+def _float64View(array):
+    """Zero-copy memoryview of a float64 array with native item access"""
+    return memoryview(array).cast("B").cast("d")
+
+
+def _searchViews(arrays):
+    """Memoryviews of the (ptr, neighbors, bottomup, importance) arrays"""
+    return (_int64View(arrays[0]), _int64View(arrays[1]), 
+            _int64View(arrays[2]), _float64View(arrays[3]))
+
+
+def _initSearchWorker(filename, num_ptr, num_edges):
+    """Process pool initializer: maps the shared search arrays once"""
+    global _worker_search
+    arrays = np.memmap(filename, dtype=np.int64, mode="r")
+    bounds = np.cumsum([0, num_ptr, num_edges, num_edges, num_edges])
+    arrays = [arrays[bounds[num]:bounds[num+1]] for num in range(4)]
+    arrays[3] = arrays[3].view(np.float64)
+    _worker_search = _searchViews(arrays)
+
+
+def _searchPathsWorker(start, outputs, options):
+    """Process pool task: paths from one input on the shared arrays"""
+    return list(_searchInput(_worker_search, start, outputs, **options))
+
+
+def _searchPathsArrays(arrays, start, outputs, options):
+    """Dask task: paths from one input on scattered search arrays"""
+    return list(_searchInput(_searchViews(arrays), start, outputs, **options))
+
+
+def iterPathsParallel(adjacency, input_keys, output_keys, rules=[1,0.5], workers=None,
+                      **options):
+    """
+    Generator version of findPathsParallel (same arguments): yields
+    the list of paths from each input, in input_keys order, as soon
+    as that input's search finishes.
+    """
+    codes = adjacency["codes"]
+    genes = adjacency["genes"]
+    starts = [codes[key] for key in input_keys if key in codes]
+    outputs = frozenset(codes[key] for key in output_keys if key in codes)
+    search = searchStructure(adjacency, rules)
+
+    if workers is None or workers == 1:
+        arrays = (search["ptr"], search["neighbors"], search["bottomup"], search["importance"])
+        for start in starts:
+            yield [[genes[node] for node in path] 
+                   for path in _searchInput(arrays, start, outputs, **options)]
+        return
+
+    arrays = (np.asarray(search["ptr"], dtype=np.int64),
+              np.asarray(search["neighbors"], dtype=np.int64),
+              np.asarray(search["bottomup"], dtype=np.int64),
+              np.asarray(search["importance"], dtype=np.float64))
+    if hasattr(workers, "scatter"):
+        # Dask client
+        arrays_future = workers.scatter(arrays, broadcast=True)
+        futures = [workers.submit(_searchPathsArrays, arrays_future, start, outputs, 
+                                  options, pure=False)
+                   for start in starts]
+        for future in futures:
+            found = future.result()
+            future.release()
+            yield [[genes[node] for node in path] for path in found]
+    else:
+        import tempfile
+        from concurrent.futures import ProcessPoolExecutor
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "search.bin")
+            np.concatenate(arrays[:3] + (arrays[3].view(np.int64),)).tofile(filename)
+            with ProcessPoolExecutor(max_workers=workers, 
+                                     initializer=_initSearchWorker,
+                                     initargs=(filename, len(arrays[0]), len(arrays[1]))) as pool:
+                for found in pool.map(_searchPathsWorker, starts, 
+                                      [outputs]*len(starts), [options]*len(starts)):
+                    yield [[genes[node] for node in path] for path in found]
+
+
+def findPathsParallel(adjacency, input_keys, output_keys, rules=[1,0.5], workers=None,
+                      **options):
+    """
+    Runs findPathsBoth for each input in input_keys and returns 
+    all paths, in input_keys order.
+    :adjacency:     adjacency index of the network (buildAdjacency)
+    :workers:       None or 1 for serial search, an integer number
+                    of processes for a local process pool, or a Dask
+                    client. Search arrays are shipped to workers once
+                    (memory-mapped file or broadcast scatter).
+    :options:       (optional) per-input search bounds of findPathsBoth
+                    (max_length, top_k, score, max_visits, time_budget)
+    """
+    paths = []
+    for paths_input in iterPathsParallel(adjacency, input_keys, output_keys, 
+                                         rules=rules, workers=workers, **options):
+        paths.extend(paths_input)
+    return paths
+
+
+def edgeLookup(adjacency):
+    """
+    Given an adjacency index, returns a hashed index of packed
+    (TF, target) code pairs mapping each edge to its GRN row
+    position. Built on first use and cached on the index.
+    """
+    if "edge_lookup" not in adjacency:
+        num_genes = len(adjacency["genes"])
+        keys = adjacency["TF"].astype(np.int64)*num_genes + adjacency["target"]
+        first = ~pd.Index(keys).duplicated()
+        adjacency["edge_lookup"] = (pd.Index(keys[first]), np.flatnonzero(first))
+    return adjacency["edge_lookup"]
+
+
+def findPathEdges(grn, pathlist, adjacency=None):
+    """
+    Given a GRN and a list of paths, maps every hop of every
+    path to the GRN row position of its (TF, target) edge in a
+    single pass. Returns the edge positions and the number of
+    hops per path.
+    """
+    if adjacency is None:
+        adjacency = buildAdjacency(grn)
+    codes = adjacency["codes"]
+    lengths = np.fromiter((len(path) for path in pathlist), dtype=np.int64)
+    try:
+        nodes = np.fromiter((codes[gene] for path in pathlist for gene in path),
+                            dtype=np.int64, count=int(lengths.sum()))
+    except KeyError as err:
+        raise ValueError("Gene "+str(err.args[0])+" in path not found in GRN") from None
+
+    # a hop joins consecutive nodes of the same path
+    is_last = np.zeros(len(nodes), dtype=bool)
+    is_last[np.cumsum(lengths[lengths > 0])-1] = True
+    is_hop = ~is_last[:-1]
+    hop_keys = nodes[:-1][is_hop]*len(adjacency["genes"]) + nodes[1:][is_hop]
+
+    keys, positions = edgeLookup(adjacency)
+    found = keys.get_indexer(hop_keys)
+    if (found < 0).any():
+        raise ValueError("Path edge not found in GRN")
+    return positions[found], np.maximum(lengths-1, 0)
+
+
+def scorePaths(grn, pathlist, adjacency=None):
+    """
+    Batched path scoring. Given a GRN and a list of paths,
+    returns 1) a dataframe of per-path importance metrics (as
+    findPathImps) and 2) the deduplicated GRN rows used by the
+    paths (as findPathRows). Hops are resolved through a hashed
+    edge index and metrics use segment reductions over hops.
+    Optionally takes a prebuilt adjacency index of grn. For a
+    CompactGRN, the rows are returned as a CompactGRN.
+    """
+    pathlist = list(pathlist)
+    edges, num_hops = findPathEdges(grn, pathlist, adjacency=adjacency)
+    num_paths = len(pathlist)
+    segments = np.repeat(np.arange(num_paths), num_hops)
+    if isinstance(grn, CompactGRN):
+        imps = grn.importance.astype(np.float64)[edges]
+    else:
+        imps = grn["importance"].to_numpy(dtype=np.float64)[edges]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        tot_imp = np.bincount(segments, weights=imps, minlength=num_paths)
+        hop_mean = tot_imp / num_hops
+        sq_dev = (imps - hop_mean[segments])**2
+        sd_imp = np.sqrt(np.bincount(segments, weights=sq_dev, minlength=num_paths) / num_hops)
+        # mean is taken over path nodes (as in findPathImps)
+        mean_imp = tot_imp / np.fromiter((len(path) for path in pathlist), 
+                                         dtype=np.float64, count=num_paths)
+        cv_imp = sd_imp / mean_imp
+
+    paths_imp = pd.DataFrame({"path": pd.Series(pathlist, dtype=object),
+                              "importance_total": tot_imp,
+                              "importance_sd": sd_imp,
+                              "importance_mean": mean_imp,
+                              "importance_cv": cv_imp})
+    paths_imp["path_string"] = ["->".join(str(gene) for gene in path) for path in pathlist]
+    paths_imp["input"] = [path[0] for path in pathlist]
+    paths_imp["output"] = [path[-1] for path in pathlist]
+    paths_imp["TF"] = [path[-2] if len(path) > 1 else np.nan for path in pathlist]
+
+    if isinstance(grn, CompactGRN):
+        rows = np.unique(edges)
+        paths_rows = grn.take(rows[np.argsort(-grn.importance[rows], kind="stable")])
+    else:
+        paths_rows = grn.iloc[edges, :].sort_values("importance", ascending=False).drop_duplicates()
+    return paths_imp, paths_rows
+
+
+def findPathImps(grn,pathlist,adjacency=None):
+    """
+    Given a GRN and a list of paths, returns the total, mean,
+    sd and cv of edge importances for each path (see scorePaths)
+    """
+    paths_imp, _ = scorePaths(grn, pathlist, adjacency=adjacency)
     return paths_imp
 
 
-def findPathRows(grn,pathlist):
+def findPathRows(grn,pathlist,adjacency=None):
     """Extract interaction pairs from paths"""
-    idxs = []
-    for paths in pathlist:
-        for item in range(len(paths)):
-            if item < len(paths)-1:
-                TF = paths[item]
-                target = paths[item+1]
-                criteria = ((grn["TF"]==TF) & (grn["target"]==target))
-                idx = grn.loc[criteria,:].index
-                idxs.extend(idx)
-    paths_idx = grn.loc[idxs,:].sort_values("importance", ascending=False).drop_duplicates()
-    return paths_idx
+    _, paths_rows = scorePaths(grn, pathlist, adjacency=adjacency)
+    return paths_rows
 
 
+# =========================
+# Default network inputs and outputs
 
+# gene families (regex) and individual genes used as outputs when output_regex=True
+OUTPUT_REGEX = (r"^COL\d{1,2}A\d$", r"^MMP\d", r"TIMP\d", r"CTS+[A-Z]", 
+                r"TGFB\d$", r"THBS\d", r"^LOX")
+OUTPUT_REGEX_OTHERS = ("SPP1","POSTN","^FN1","SPARC$",
+                       "TNC","CTGF","SERPINE1","ACTA2")
 
+OUTPUTS = ["CTGF","FN1","ACTA2","TIMP1","TIMP2","SERPINE1","MMP12",
+           "MMP14","MMP1","MMP2","MMP3","MMP8","MMP9","POSTN","COL1A1",
+           "COL1A2","COL3A1","TNC","THBS4","SPP1"]
 
+INPUTS = ["STAT1","STAT3","JUN","FOS","NFKB1","RELA","CREB1","CREBBP",
+          "SMAD3","MYC","NFATC1","NFATC3","SRF","TEAD2","TEAD4","YAP1","WWTR1"]
 
 
 # =========================
@@ -229,10 +787,17 @@ def refineGRN(grn,
             libraryname, 
             dir_path="D:\\Research\\Aim3\\data_TFdatabases\\", 
             lib_both=True, 
-            output_regex=False):
+            output_regex=False,
+            workers=None,
+            library=None,
+            profiler=None,
+            search_options=None,
+            rules=[1,0.75],
+            cache_dir=None):
     """
     Top-level function for GRN refinement.
-    :grn:           n x 3 pandas dataframe containing "TF", "target" and "importance"
+    :grn:           n x 3 pandas dataframe containing "TF", "target" and "importance",
+                    or a CompactGRN (the refined edges are then a CompactGRN)
     :libraryname:   string containing TF-target database used for pruning
                         Current options:    "CHEA", "TRANSFACpredicted", 
                                             "TRANSFACcurated", "ENCODE"
@@ -241,6 +806,20 @@ def refineGRN(grn,
     :lib_both:      Boolean determining 'both' argument in importLibraries fcn
     :output_regex:  Boolean determining whether regex should be used in 
                     choosing gene outputs (i.e. gene families)
+    :workers:       (optional) number of processes or Dask client used to
+                    search paths from each input in parallel (see 
+                    findPathsParallel); default is a serial search
+    :library:       (optional) prebuilt library index (buildLibraryIndex) or
+                    library df used instead of importing libraryname
+    :profiler:      (optional) GRNprofile.Profiler recording stage timings
+                    and row/path counts
+    :search_options:(optional) dict of per-input path search bounds
+                    (max_length, top_k, score, max_visits, time_budget;
+                    see findPathsBoth) for large networks
+    :rules:         (optional) top-down/bottom-up search rules (importance
+                    cutoff, neighbour importance quantile)
+    :cache_dir:     (optional) directory for the parsed-library cache 
+                    (default dir_path/.grncache; False keeps it in-process)
     :grn_final:     n x 3 pandas datafram containing refined edges
     """
     # import df
@@ -250,52 +829,197 @@ def refineGRN(grn,
     # grn = grn.reset_index()
     # print(grn.shape)
 
+    profiler = gp.getProfiler(profiler)
+
     # filter for edges contained in librar(ies)
-    library = importLibraries(dir_path, libraryname, both=lib_both)
-    grn_targets = filterWithLibrary(grn, library)
-    print(grn_targets.shape)
+    if library is None:
+        with profiler.stage("library_load", library=libraryname) as record:
+            library = importLibraryIndex(dir_path, libraryname, both=lib_both,
+                                         cache_dir=cache_dir)
+            record["rows"] = len(library["keys"])
 
     # filter for edges connected to desired inputs/outputs
-    if output_regex:
-        reg_col = r"^COL\d{1,2}A\d$"
-        reg_mmp = r"^MMP\d"
-        reg_timp = r"TIMP\d"
-        reg_cts = r"CTS+[A-Z]"
-        reg_tgfb = r"TGFB\d$"
-        reg_thbs = r"THBS\d"
-        reg_lox = r"^LOX"
-        reg_others = ("SPP1","POSTN","^FN1","SPARC$",
-                    "TNC","CTGF","SERPINE1","ACTA2")
-
-        outputs = findOutputs(grn, 
-                            reg_col, reg_mmp, reg_timp, reg_cts, 
-                            reg_tgfb, reg_thbs, reg_lox, 
-                            indivregs=reg_others)
-    else:
-        outputs = ["CTGF","FN1","ACTA2","TIMP1","TIMP2","SERPINE1","MMP12",
-                "MMP14","MMP1","MMP2","MMP3","MMP8","MMP9","POSTN","COL1A1",
-                "COL1A2","COL3A1","TNC","THBS4","SPP1"]
-    
-    inputs = ["STAT1","STAT3","JUN","FOS","NFKB1","RELA","CREB1","CREBBP",
-            "SMAD3","MYC","NFATC1","NFATC3","SRF","TEAD2","TEAD4","YAP1","WWTR1"]
-    
-    input_keys = findInputsOrOutputs(grn_targets, inputs, "TF")
-    output_keys = findInputsOrOutputs(grn_targets, outputs, "target")
-    grn_outputs = filterInputsOrOutputs(grn_targets, output_keys, "target")
-    grn_inputs = filterInputsOrOutputs(grn_targets, input_keys, "TF")
-    paths_all_inout = filterInOutNetwork(grn_inputs, grn_outputs, grn_targets)
-    print(paths_all_inout.shape)
+    paths_all_inout, input_keys, output_keys = inOutSubnetwork(grn, library, 
+                                                               output_regex=output_regex,
+                                                               profiler=profiler)
 
     # find input-output paths via modified DFS algorithm
-    paths_found_bothsearch = []
-    for inp in input_keys:
-        paths_found_bothsearch.extend(list(findPathsBoth(paths_all_inout, 
-                                                        inp, output_keys, 
-                                                        rules=[1,0.75])))
-    paths_found_bothsearch_imp = findPathImps(paths_all_inout, 
-                                            paths_found_bothsearch)
-    grn_final = findPathRows(paths_all_inout.reset_index(), 
-                            paths_found_bothsearch_imp["path"])
-    print(grn_final.shape)
-
-    return grn_final
\ No newline at end of file
+    grn_final = refinePaths(paths_all_inout, input_keys, output_keys, rules=rules,
+                            workers=workers, search_options=search_options, 
+                            profiler=profiler)
+    return grn_final
+
+
+def inOutSubnetwork(grn, library, outputs=None, output_regex=False, profiler=None):
+    """
+    Filters a GRN for edges contained in a library index and 
+    connected to the network inputs/outputs (first stages of 
+    refineGRN). Returns the input-output subnetwork and the
+    input and output genes found in it.
+    :outputs:       (optional) list of output genes (default: OUTPUTS,
+                    or regex families if output_regex)
+    """
+    profiler = gp.getProfiler(profiler)
+    with profiler.stage("library_filter") as record:
+        grn_targets = filterWithLibrary(grn, library)
+        record["rows"] = len(grn_targets)
+
+    with profiler.stage("inout_filter") as record:
+        if outputs is None:
+            if output_regex:
+                outputs = findOutputs(grn, *OUTPUT_REGEX, indivregs=OUTPUT_REGEX_OTHERS)
+            else:
+                outputs = OUTPUTS
+        
+        inputs = INPUTS
+        
+        input_keys = findInputsOrOutputs(grn_targets, inputs, "TF")
+        output_keys = findInputsOrOutputs(grn_targets, outputs, "target")
+        grn_outputs = filterInputsOrOutputs(grn_targets, output_keys, "target")
+        grn_inputs = filterInputsOrOutputs(grn_targets, input_keys, "TF")
+        paths_all_inout = filterInOutNetwork(grn_inputs, grn_outputs, grn_targets)
+        record["rows"] = len(paths_all_inout)
+    return paths_all_inout, input_keys, output_keys
+
+
+def refinePaths(paths_all_inout, input_keys, output_keys, rules=[1,0.75], 
+                adjacency=None, workers=None, search_options=None, profiler=None):
+    """
+    Finds input-output paths in a subnetwork (inOutSubnetwork) and
+    returns the GRN rows used by them (last stages of refineGRN).
+    Optionally takes a prebuilt adjacency index of the subnetwork,
+    whose quantile and search tables are then shared across rules.
+    """
+    profiler = gp.getProfiler(profiler)
+    with profiler.stage("dfs", rules=list(rules)) as record:
+        if adjacency is None:
+            adjacency = buildAdjacency(paths_all_inout)
+        paths_found_bothsearch = findPathsParallel(adjacency, input_keys, output_keys, 
+                                                   rules=rules, workers=workers,
+                                                   **(search_options or {}))
+        record["paths"] = len(paths_found_bothsearch)
+    with profiler.stage("path_scoring") as record:
+        if isinstance(paths_all_inout, CompactGRN):
+            paths_all_inout = paths_all_inout.resetIndex()
+        else:
+            paths_all_inout = paths_all_inout.reset_index()
+        paths_found_bothsearch_imp, grn_final = scorePaths(paths_all_inout, 
+                                                          paths_found_bothsearch,
+                                                          adjacency=adjacency)
+        record["rows"] = len(grn_final)
+    return grn_final
+
+
+# =========================
+# Batch refinement
+
+def configName(config):
+    """
+    Returns a default name for a batch refinement configuration
+    (custom output sets are told apart by a digest of the sorted outputs)
+    """
+    rules = config.get("rules", [1,0.75])
+    name = config["libraryname"] + ("_both" if config.get("lib_both", True) else "")
+    if config.get("outputs") is not None:
+        name = name + "_custom_" + gc.keyDigest(tuple(sorted(set(config["outputs"]))))[:8]
+    elif config.get("output_regex", False):
+        name = name + "_regex"
+    return name + "_" + str(rules[0]) + "_" + str(rules[1])
+
+
+def _refineGroup(grn, library, outputs, output_regex, rules_list, search_options):
+    """
+    Refines a GRN for configurations sharing a library and output 
+    set: the subnetwork and its adjacency index (with its per-node 
+    quantile tables) are built once and reused for each rules setting.
+    """
+    paths_all_inout, input_keys, output_keys = inOutSubnetwork(grn, library, outputs=outputs,
+                                                               output_regex=output_regex)
+    adjacency = buildAdjacency(paths_all_inout)
+    return [refinePaths(paths_all_inout, input_keys, output_keys, rules=rules, 
+                        adjacency=adjacency, search_options=search_options)
+            for rules in rules_list]
+
+
+_worker_grn = None
+
+def _initBatchWorker(grn):
+    """Process pool initializer: receives the GRN once per process"""
+    global _worker_grn
+    _worker_grn = grn
+
+
+def _refineGroupWorker(library, outputs, output_regex, rules_list, search_options):
+    """Process pool task: _refineGroup on the worker's GRN"""
+    return _refineGroup(_worker_grn, library, outputs, output_regex, rules_list, search_options)
+
+
+def refineGRNBatch(grn, configs, 
+                   dir_path="D:\\Research\\Aim3\\data_TFdatabases\\",
+                   workers=None, 
+                   search_options=None,
+                   cache_dir=None):
+    """
+    Refines one GRN for a grid of configurations in one pass. Each
+    library is imported once, and configurations sharing a library 
+    and output set share the filtered subnetwork, its adjacency 
+    index and per-node quantile tables (only the path search and 
+    scoring are repeated per rules setting).
+    :grn:           n x 3 pandas dataframe containing "TF", "target" and "importance",
+                    or a CompactGRN (dataframes are converted to one, float64)
+    :configs:       list of dicts with keys "libraryname" and optionally
+                    "lib_both" (default True), "rules" (default [1,0.75]),
+                    "output_regex" (default False), "outputs" (list of 
+                    output genes) and "name" (default from configName)
+    :dir_path:      top-level directory for all databases (as refineGRN)
+    :workers:       (optional) number of processes refining groups of
+                    configurations in parallel; default is serial
+    :search_options:(optional) dict of path search bounds (as refineGRN)
+    :cache_dir:     (optional) directory for the parsed-library cache (as refineGRN)
+    :grn_all:       refined edges of all configurations, with a "config"
+                    column holding the configuration name
+    """
+    # refine a compact copy of the GRN (float64, as saved by the caller)
+    if not isinstance(grn, CompactGRN):
+        grn = CompactGRN.fromFrame(grn, dtype=np.float64)
+
+    # group configurations by library and output set
+    names = [config.get("name", configName(config)) for config in configs]
+    duplicates = sorted(set(name for name in names if names.count(name) > 1))
+    if duplicates:
+        raise ValueError("Duplicate configuration names: "+", ".join(duplicates))
+    groups = {}
+    for config, name in zip(configs, names):
+        outputs = config.get("outputs")
+        key = (config["libraryname"], config.get("lib_both", True), 
+               None if outputs is None else tuple(outputs), 
+               config.get("output_regex", False))
+        groups.setdefault(key, []).append((name, config.get("rules", [1,0.75])))
+
+    libraries = {}
+    tasks = []
+    for (libraryname, lib_both, outputs, output_regex), members in groups.items():
+        if (libraryname, lib_both) not in libraries:
+            libraries[(libraryname, lib_both)] = importLibraryIndex(dir_path, libraryname, 
+                                                                    both=lib_both,
+                                                                    cache_dir=cache_dir)
+        tasks.append((libraries[(libraryname, lib_both)], 
+                      None if outputs is None else list(outputs), output_regex,
+                      [rules for _, rules in members], search_options))
+
+    if workers is None or workers == 1:
+        results = [_refineGroup(grn, *task) for task in tasks]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers, initializer=_initBatchWorker,
+                                 initargs=(grn,)) as pool:
+            results = list(pool.map(_refineGroupWorker, *zip(*tasks)))
+
+    grns_final = []
+    for members, grns_group in zip(groups.values(), results):
+        for (name, _), grn_final in zip(members, grns_group):
+            grn_final = grn_final.toFrame()
+            grn_final["config"] = name
+            grns_final.append(grn_final)
+    grn_all = pd.concat(grns_final, axis=0)
+    return grn_all
@@ -0,0 +1,235 @@
+"""
+Functions for storing cross validation results, including:
+- Appendable on-disk store partitioned by fold
+- Lazy iteration over stored folds
+- Run manifest for checkpointed/resumable runs (in the store, or
+  alongside CSV/TXT results saved to a directory)
+"""
+
+import os
+import json
+import shutil
+import importlib
+import pandas as pd
+
+
+def defaultFormat():
+    """Returns "parquet" if a Parquet engine is importable, else "csv" """
+    for engine in ("pyarrow", "fastparquet"):
+        try:
+            importlib.import_module(engine)
+            return "parquet"
+        except ImportError:
+            continue
+    return "csv"
+
+
+def foldDir(storedir, fold):
+    """Returns path of the partition directory for a fold"""
+    return os.path.join(storedir, "fold="+str(fold))
+
+
+def writeDatasets(filepath, training, testing):
+    """Writes training/testing sample names as in saveGRN"""
+    with open(filepath, "w") as output:
+        output.write("_Training_\n")
+        for train in training:
+            output.write(train + "\n")
+        output.write("_Testing_\n")
+        for test in testing:
+            output.write(test + "\n")
+
+
+def readDatasets(filepath):
+    """
+    Reads a datasets file (as written by saveGRN/writeDatasets)
+    and returns lists of training and testing sample names.
+    """
+    training = []
+    testing = []
+    current = None
+    with open(filepath) as infile:
+        for line in infile:
+            line = line.rstrip("\r\n")
+            if line == "_Training_":
+                current = training
+            elif line == "_Testing_":
+                current = testing
+            elif line and current is not None:
+                current.append(line)
+    return training, testing
+
+
+def writeFold(storedir, fold, grn, training, testing, fmt=None):
+    """
+    Writes one fold's refined GRN and training/testing sample lists
+    to the store as partition storedir/fold=<fold>/. The partition
+    is written to a temporary directory and renamed, so a fold is
+    either complete on disk or absent.
+    :fmt:   "parquet", "feather" or "csv" (default: defaultFormat())
+    """
+    if fmt is None:
+        fmt = defaultFormat()
+    partition = foldDir(storedir, fold)
+    tmpdir = partition+".tmp"
+    if os.path.isdir(tmpdir):
+        shutil.rmtree(tmpdir)
+    os.makedirs(tmpdir)
+    if fmt == "parquet":
+        grn.to_parquet(os.path.join(tmpdir, "grn.parquet"))
+    elif fmt == "feather":
+        grn.reset_index().to_feather(os.path.join(tmpdir, "grn.feather"))
+    elif fmt == "csv":
+        grn.to_csv(os.path.join(tmpdir, "grn.csv"))
+    else:
+        raise ValueError("Unknown store format: "+str(fmt))
+    writeDatasets(os.path.join(tmpdir, "datasets.txt"), training, testing)
+    if os.path.isdir(partition):
+        shutil.rmtree(partition)
+    os.rename(tmpdir, partition)
+    return partition
+
+
+def readFold(storedir, fold):
+    """
+    Reads one fold from the store and returns its refined GRN and
+    lists of training and testing sample names.
+    """
+    partition = foldDir(storedir, fold)
+    if os.path.isfile(os.path.join(partition, "grn.parquet")):
+        grn = pd.read_parquet(os.path.join(partition, "grn.parquet"))
+    elif os.path.isfile(os.path.join(partition, "grn.feather")):
+        grn = pd.read_feather(os.path.join(partition, "grn.feather"))
+        grn = grn.set_index(grn.columns[0]).rename_axis(None)
+    else:
+        grn = pd.read_csv(os.path.join(partition, "grn.csv"), index_col=0)
+    training, testing = readDatasets(os.path.join(partition, "datasets.txt"))
+    return grn, training, testing
+
+
+def storedFolds(storedir):
+    """Returns sorted list of folds written to the store"""
+    if not os.path.isdir(storedir):
+        return []
+    folds = []
+    for entry in os.listdir(storedir):
+        if entry.startswith("fold=") and not entry.endswith(".tmp"):
+            folds.append(int(entry[len("fold="):]))
+    return sorted(folds)
+
+
+def iterFolds(storedir, folds=None):
+    """
+    Lazily iterates over stored folds (in fold order), yielding
+    (fold, grn, training, testing) one fold at a time.
+    """
+    if folds is None:
+        folds = storedFolds(storedir)
+    for fold in folds:
+        grn, training, testing = readFold(storedir, fold)
+        yield fold, grn, training, testing
+
+
+def loadFolds(storedir, folds=None):
+    """Returns all stored folds as one dataframe with a "fold" column"""
+    grns = []
+    for fold, grn, _, _ in iterFolds(storedir, folds=folds):
+        grn["fold"] = fold
+        grns.append(grn)
+    return pd.concat(grns, axis=0)
+
+
+# =========================
+# Run manifest (checkpointing)
+
+def manifestPath(storedir):
+    """Returns path of the run manifest in the store"""
+    return os.path.join(storedir, "manifest.json")
+
+
+def readManifest(storedir):
+    """Returns the run manifest of the store, or None if absent"""
+    if not os.path.isfile(manifestPath(storedir)):
+        return None
+    with open(manifestPath(storedir)) as infile:
+        return json.load(infile)
+
+
+def writeManifest(storedir, manifest):
+    """Writes the run manifest atomically (temporary file + rename)"""
+    os.makedirs(storedir, exist_ok=True)
+    tmpfile = manifestPath(storedir)+".tmp"
+    with open(tmpfile, "w") as output:
+        json.dump(manifest, output, indent=1)
+    os.replace(tmpfile, manifestPath(storedir))
+
+
+def startRun(storedir, config, makefolds, resume=True):
+    """
+    Opens a checkpointed run in the store. If a manifest exists and
+    resume is True, checks that config matches the recorded run and
+    returns it (fold assignment and completed folds included);
+    otherwise calls makefolds() and records a new manifest.
+    :config:    dict of run settings (dataset, library, k, seeds, ...)
+    :makefolds: function returning nested list of fold sample names
+    """
+    manifest = readManifest(storedir)
+    if manifest is not None and resume:
+        for key, value in config.items():
+            if manifest["config"].get(key) != value:
+                raise ValueError("Run manifest in "+storedir+" has "+key+"="+
+                                 str(manifest["config"].get(key))+", not "+str(value)+
+                                 "; use another store or resume=False")
+        return manifest
+    manifest = {"config": config, "folds": makefolds(), "completed": []}
+    writeManifest(storedir, manifest)
+    return manifest
+
+
+def completedFolds(storedir, manifest=None):
+    """Returns folds recorded as complete that are present in the store"""
+    if manifest is None:
+        manifest = readManifest(storedir)
+    if manifest is None:
+        return []
+    stored = set(storedFolds(storedir))
+    return sorted(fold for fold in manifest["completed"] if fold in stored)
+
+
+def savedFoldPaths(savedir, fold, suffix=None):
+    """Returns paths of a fold's GRN CSV and datasets file as written by saveGRN"""
+    suffix = "" if suffix is None else "_"+suffix
+    return (savedir+"GRN_CV_fold"+str(fold)+suffix+".csv", 
+            savedir+"datasets_CV_fold"+str(fold)+suffix+".txt")
+
+
+def savedFolds(savedir, training, testing, suffix=None):
+    """
+    Returns folds already saved to savedir (saveGRN CSV/TXT files)
+    for the given fold assignment: the GRN file exists and the 
+    datasets file lists the fold's training and testing samples.
+    """
+    folds = []
+    for fold in range(len(testing)):
+        grnfile, setsfile = savedFoldPaths(savedir, fold, suffix=suffix)
+        if not (os.path.isfile(grnfile) and os.path.isfile(setsfile)):
+            continue
+        if readDatasets(setsfile) == (list(training[fold]), list(testing[fold])):
+            folds.append(fold)
+    return folds
+
+
+def readSavedFold(savedir, fold, suffix=None):
+    """Reads a fold's refined GRN saved to savedir by saveGRN"""
+    return pd.read_csv(savedFoldPaths(savedir, fold, suffix=suffix)[0], index_col=0,
+                       float_precision="round_trip")
+
+
+def markFoldComplete(storedir, fold):
+    """Records a fold as complete in the run manifest"""
+    manifest = readManifest(storedir)
+    if manifest is None:
+        return
+    if fold not in manifest["completed"]:
+        manifest["completed"] = sorted(manifest["completed"] + [fold])
+    writeManifest(storedir, manifest)
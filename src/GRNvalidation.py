@@ -4,15 +4,23 @@ Scripts for generating cross validation folds and datasets
 
 import random
 
-def makeFolds(data, k):
+def makeFolds(data, k, seed=None):
     """
-    Given a dataframe of cpm values, randomly 
-    creates k folds and returns nested list of 
-    column names.
+    Given a dataframe of cpm values (or a list of
+    sample names), randomly creates k folds and 
+    returns nested list of column names. An optional
+    seed makes the shuffle reproducible (without it,
+    the global random state is used).
     """
     # randomize columns
-    order = data.columns.tolist()
-    random.shuffle(order)
+    if hasattr(data, "columns"):
+        order = data.columns.tolist()
+    else:
+        order = list(data)
+    if seed is None:
+        random.shuffle(order)
+    else:
+        random.Random(seed).shuffle(order)
     # split into folds (specified by k)
     folds = []
     fold = 0